@@ -0,0 +1,169 @@
+# aot.py
+
+import argparse
+import hashlib
+import importlib.util
+import os
+import sys
+import jit
+from cpu import CPU, MEMORY_SIZE, PROGRAM_START_ADDRESS
+from globals import log_debug
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE, detect_profile
+
+# Translated ROMs are cached here as Python modules, one per ROM content hash and quirk profile
+CACHE_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "chip8-emulator", "aot")
+
+# Bumped when cached translations must not be reused for a reason the sources below don't show
+CACHE_VERSION = 1
+
+# Sources the translated code is generated from or calls back into, a change to any of them invalidates the cache
+GENERATOR_SOURCES = tuple(os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+                          for name in ("aot.py", "jit.py", "cpu.py", "quirks.py"))
+
+
+# Function to list the addresses execution can continue at after the instruction at address
+# Computed jumps (BNNN) and returns (00EE) can't be followed statically, calls continue after the call too
+def successors(opcode, address):
+    first_nibble = opcode >> 12
+    if opcode == 0x00EE or first_nibble == 0xB:
+        return []
+    if first_nibble == 0x1:
+        return [opcode & 0x0FFF]
+    if first_nibble == 0x2:
+        return [opcode & 0x0FFF, address + 2]
+    if first_nibble in (0x3, 0x4, 0x5, 0x9, 0xE):
+        return [address + 2, address + 4]
+    return [address + 2]
+
+
+# Function to walk the control flow from start, splitting the reachable code into the blocks the JIT would use
+# Returns start address -> (source, instruction count, end address), the source is None where the interpreter runs
+def walk_blocks(memory, start=PROGRAM_START_ADDRESS, quirks=QUIRK_PROFILES[DEFAULT_PROFILE]):
+    blocks = {}
+    pending = [start]
+    while pending:
+        address = pending.pop()
+        if address in blocks or address + 1 >= MEMORY_SIZE:
+            continue
+        source, count, end = jit.generate_block(memory, address, f"block_{address:03X}", quirks)
+        blocks[address] = (source, count, max(end, address + 2))
+
+        # A block continues wherever its last instruction does
+        last = end - 2 if count else address
+        pending.extend(successors(memory[last] << 8 | memory[last + 1], last))
+    return blocks
+
+
+# Function to list the instructions reachable from start as address -> opcode
+def reachable_opcodes(memory, start=PROGRAM_START_ADDRESS):
+    opcodes = {}
+    for address, (_, count, _) in walk_blocks(memory, start).items():
+        # Blocks the JIT can't compile still hold the one instruction the interpreter runs
+        for offset in range(0, 2 * max(count, 1), 2):
+            if address + offset + 1 < MEMORY_SIZE:
+                opcodes[address + offset] = memory[address + offset] << 8 | memory[address + offset + 1]
+    return opcodes
+
+
+# Function to translate the code reachable in memory into the source of a Python module
+def translate(memory, rom_hash, profile=DEFAULT_PROFILE):
+    blocks = walk_blocks(memory, quirks=QUIRK_PROFILES[profile])
+    lines = [f"# Ahead-of-time translation of ROM {rom_hash}, {profile} quirks", "",
+             f"ROM_SHA256 = {rom_hash!r}", ""]
+    for address in sorted(blocks):
+        source = blocks[address][0]
+        if source is not None:
+            lines += ["", source]
+
+    # Start address -> (function, instruction count, end address), as in the JIT's block cache
+    lines += ["", "BLOCKS = {"]
+    for address in sorted(blocks):
+        source, count, end = blocks[address]
+        function = f"block_{address:03X}" if source is not None else "None"
+        lines.append(f"    {address}: ({function}, {count}, {end}),")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+# Function to fingerprint the code generator, translations made by different generator sources aren't reused
+def generator_fingerprint():
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for path in GENERATOR_SOURCES:
+        with open(path, "rb") as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:16]
+
+
+# Function to find the cache file for a ROM hash and quirk profile
+def cache_path(rom_hash, profile=DEFAULT_PROFILE, cache_directory=CACHE_DIRECTORY):
+    return os.path.join(cache_directory, f"{rom_hash}-{profile}-{generator_fingerprint()}.py")
+
+
+# Function to import a translated module from its file
+def load_module(path, rom_hash):
+    spec = importlib.util.spec_from_file_location(f"chip8_aot_{rom_hash[:16]}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    if module.ROM_SHA256 != rom_hash:
+        raise ValueError(f"{path} was translated from ROM {module.ROM_SHA256}")
+    return module
+
+
+# Function to translate the ROM just loaded into cpu for its quirk profile, or reuse the cached translation, and fill the JIT's block cache
+# Returns True if the translation came from the cache
+def install(cpu, rom_path, cache_directory=CACHE_DIRECTORY):
+    if cpu.jit is None:
+        raise ValueError("Ahead-of-time translation needs a CPU created with jit=True")
+    with open(rom_path, "rb") as rom_file:
+        rom_data = rom_file.read()
+    # Blocks are translated from the ROM as loaded, so the program mustn't have run yet
+    if cpu.memory[PROGRAM_START_ADDRESS:PROGRAM_START_ADDRESS + len(rom_data)] != rom_data:
+        raise ValueError(f"{rom_path} isn't the program in memory")
+
+    rom_hash = hashlib.sha256(rom_data).hexdigest()
+    path = cache_path(rom_hash, cpu.quirk_profile, cache_directory)
+    module = None
+    if os.path.exists(path):
+        try:
+            module = load_module(path, rom_hash)
+        except Exception as error:
+            log_debug("Ignoring cached translation %s: %s", path, error)
+
+    cached = module is not None
+    if not cached:
+        source = translate(cpu.memory, rom_hash, cpu.quirk_profile)
+        os.makedirs(cache_directory, exist_ok=True)
+        # Written to a temporary file first so a concurrent launch never imports half a module
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as module_file:
+            module_file.write(source)
+        os.replace(temporary_path, path)
+        module = load_module(path, rom_hash)
+
+    # Unreached code is compiled by the JIT as usual, and writes to translated code invalidate it like any block
+    for address, (function, count, end) in module.BLOCKS.items():
+        cpu.jit.add_block(address, function, count, end)
+    log_debug("Installed %d translated blocks for %s (%s)", len(module.BLOCKS), rom_path,
+              "cached" if cached else "translated")
+    return cached
+
+
+# Translate ROMs ahead of time so their first launch finds them in the cache
+def main(argv):
+    parser = argparse.ArgumentParser(description="Translate Chip-8 ROMs into cached Python modules")
+    parser.add_argument("roms", nargs="+", help="ROM files to translate")
+    parser.add_argument("--cache", default=CACHE_DIRECTORY, help="cache directory")
+    parser.add_argument("--quirks", choices=sorted(QUIRK_PROFILES), help="quirk profile, detected per ROM by default")
+    args = parser.parse_args(argv)
+
+    for rom in args.roms:
+        with open(rom, "rb") as rom_file:
+            profile = args.quirks or detect_profile(rom_file.read())
+        cpu = CPU(jit=True, quirks=profile)
+        cpu.load_rom(rom)
+        cached = install(cpu, rom, args.cache)
+        print(f"{rom}: {len(cpu.jit.blocks)} blocks, {profile} quirks, {'cached' if cached else 'translated'}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,149 @@
+# batch.py
+
+import aot
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import time
+from cpu import CPU
+from globals import status_items
+from quirks import QUIRK_PROFILES, detect_profile
+from scheduler import DEFAULT_INSTRUCTIONS_PER_FRAME
+
+
+# Function to read an input script, one "<cycle> <key> down|up" event per line, # starts a comment
+# Returns a list of (cycle, key, pressed) tuples sorted by cycle
+def load_input_script(path):
+    events = []
+    with open(path) as script:
+        for line_number, line in enumerate(script, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                cycle, key, state = line.split()
+                events.append((int(cycle), int(key, 16), state == "down"))
+            except ValueError:
+                raise ValueError(f"{path}:{line_number}: expected '<cycle> <key> down|up', got {line!r}")
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+# Function to hash the packed framebuffer rows
+def framebuffer_hash(display):
+    row_bytes = display.width // 8
+    return hashlib.sha1(b"".join(row.to_bytes(row_bytes, "big") for row in display.rows)).hexdigest()
+
+
+# Function to run one job headless in a worker process and return its result
+# A job is a dict with "rom", "cycles" and optionally "input", "ipf", "jit", "aot" and "quirks"
+def run_job(job):
+    result = {"rom": job["rom"], "cycles": job["cycles"]}
+    status_items["error"] = ""
+
+    try:
+        with open(job["rom"], "rb") as rom_file:
+            profile = job.get("quirks") or detect_profile(rom_file.read())
+        cpu = CPU(jit=job.get("jit", False) or job.get("aot", False), quirks=profile)
+        cpu.load_rom(job["rom"])
+        result["quirks"] = profile
+        if job.get("aot"):
+            aot.install(cpu, job["rom"])
+        events = load_input_script(job["input"]) if job.get("input") else []
+        instructions_per_frame = job.get("ipf", DEFAULT_INSTRUCTIONS_PER_FRAME)
+        cycles = job["cycles"]
+        next_event = 0
+
+        start = time.perf_counter()
+        while cpu.cycles < cycles:
+            frame_end = min(cpu.cycles + instructions_per_frame, cycles)
+
+            # Apply the input events that fall inside this frame at their exact cycle
+            while next_event < len(events) and events[next_event][0] < frame_end:
+                cycle, key, pressed = events[next_event]
+                if cycle > cpu.cycles:
+                    cpu.run_cycles(cycle - cpu.cycles)
+                if pressed:
+                    cpu.keyboard.press(key)
+                else:
+                    cpu.keyboard.release(key)
+                next_event += 1
+
+            frame_start = cpu.cycles
+            cpu.run_cycles(frame_end - cpu.cycles)
+            cpu.tick_timers()
+
+            # FX0A is waiting and no cycles pass until a key arrives, so deliver the next scripted event now
+            if cpu.cycles == frame_start:
+                if next_event == len(events):
+                    result["waiting_for_key"] = True
+                    break
+                _, key, pressed = events[next_event]
+                if pressed:
+                    cpu.keyboard.press(key)
+                else:
+                    cpu.keyboard.release(key)
+                next_event += 1
+        elapsed = time.perf_counter() - start
+
+        result["framebuffer_sha1"] = framebuffer_hash(cpu.display)
+        result["pc"] = f"{cpu.pc:03X}"
+        result["unknown_opcodes"] = cpu.unknown_opcodes
+        result["error"] = status_items["error"]
+        result["instructions_per_second"] = round(cpu.cycles / elapsed) if elapsed > 0 else None
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+
+    return result
+
+
+# Function to expand ROM arguments, directories are searched for .ch8 files
+def find_roms(paths):
+    roms = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in os.walk(path):
+                roms.extend(os.path.join(directory, name) for name in sorted(files) if name.endswith(".ch8"))
+        else:
+            roms.append(path)
+    return roms
+
+
+# Function to build the job list from the command line, or from a JSON lines job file
+# Keys a job file leaves out come from the command line, so library.py list output runs as is
+def build_jobs(args):
+    defaults = {"cycles": args.cycles, "input": args.input, "ipf": args.ipf, "jit": args.jit, "aot": args.aot,
+                "quirks": args.quirks}
+    if args.jobs:
+        with open(args.jobs) as job_file:
+            return [{**defaults, **json.loads(line)} for line in job_file if line.strip()]
+    return [{**defaults, "rom": rom} for rom in find_roms(args.roms)]
+
+
+# Run a ROM corpus across a process pool, streaming one JSON line per finished job
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run Chip-8 ROMs headless in parallel")
+    parser.add_argument("roms", nargs="*", help="ROM files or directories of .ch8 files")
+    parser.add_argument("--jobs", help="JSON lines file of jobs instead of ROM arguments")
+    parser.add_argument("--cycles", type=int, default=100000, help="instructions to run per ROM")
+    parser.add_argument("--input", help="input script applied to every ROM")
+    parser.add_argument("--ipf", type=int, default=DEFAULT_INSTRUCTIONS_PER_FRAME,
+                        help="instructions per 60Hz timer tick")
+    parser.add_argument("--jit", action="store_true", help="run through the basic-block JIT")
+    parser.add_argument("--aot", action="store_true", help="translate ROMs ahead of time, cached on disk")
+    parser.add_argument("--quirks", choices=sorted(QUIRK_PROFILES), help="quirk profile, detected per ROM by default")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    args = parser.parse_args(argv)
+
+    jobs = build_jobs(args)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            print(json.dumps(future.result()), flush=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
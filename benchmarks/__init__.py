@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+# Synthetic ROM benchmarks, run with: python3 -m benchmarks
@@ -0,0 +1,112 @@
+# benchmarks/__main__.py
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from cpu import CPU
+from benchmarks.roms import ROMS
+
+# Default baseline file, next to this package
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+# Function to run one synthetic ROM headless and measure its throughput and peak memory
+# The fastest of several repeats is kept to keep scheduling noise out of the numbers
+def run_benchmark(rom, instructions, jit=False, repeats=3):
+    cpu = CPU(jit=jit)
+    cpu.load_program(rom)
+
+    # Warm up the decode and block caches before timing
+    cpu.run_cycles(min(instructions, 1000))
+
+    elapsed = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        cpu.run_cycles(instructions)
+        run_time = time.perf_counter() - start
+        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+
+    # A benchmark that hits unknown opcodes would mostly time the unknown-opcode path instead of its family
+    if cpu.unknown_opcodes:
+        raise ValueError(f"Benchmark ROM ran {cpu.unknown_opcodes} unknown opcodes")
+
+    # Peak memory is measured on a separate, shorter run since tracemalloc slows everything down
+    tracemalloc.start()
+    cpu = CPU(jit=jit)
+    cpu.load_program(rom)
+    cpu.run_cycles(min(instructions, 10000))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "instructions_per_second": round(instructions / elapsed),
+        "ns_per_instruction": round(elapsed / instructions * 1e9, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+# Function to compare results against a baseline, returns the benchmarks that got slower than the threshold
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if previous is None:
+            continue
+        ratio = result["instructions_per_second"] / previous["instructions_per_second"]
+        if ratio < 1 - threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Per-opcode-family emulator benchmarks")
+    parser.add_argument("names", nargs="*", help=f"benchmarks to run, from {', '.join(ROMS)}")
+    parser.add_argument("--instructions", type=int, default=200000, help="instructions run per benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per benchmark, the fastest is kept")
+    parser.add_argument("--jit", action="store_true", help="run through the basic-block JIT")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="fractional slowdown against the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = {
+        "python": platform.python_version(),
+        "engine": "jit" if args.jit else "interpreter",
+        "instructions": args.instructions,
+        "benchmarks": {},
+    }
+    for name in args.names or ROMS:
+        result = run_benchmark(ROMS[name](), args.instructions, args.jit, args.repeats)
+        results["benchmarks"][name] = result
+        print(f"{name:8s} {result['instructions_per_second']:12,d} instr/s "
+              f"{result['ns_per_instruction']:10.1f} ns/instr {result['peak_kib']:10.1f} KiB peak")
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save to create one")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("engine") != results["engine"]:
+        print(f"Baseline was measured with the {baseline.get('engine')} engine, comparing anyway")
+
+    regressions = find_regressions(results, baseline, args.threshold)
+    for name, ratio in regressions:
+        print(f"REGRESSION {name}: {ratio:.0%} of baseline throughput")
+    if not regressions:
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
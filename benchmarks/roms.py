@@ -0,0 +1,95 @@
+# benchmarks/roms.py
+import struct
+
+# Every synthetic ROM is a loop of about this many instructions ending in a jump back to the start
+LOOP_LENGTH = 64
+
+
+# Function to assemble a list of 16-bit opcodes into ROM bytes
+def assemble(opcodes):
+    return b"".join(struct.pack(">H", opcode) for opcode in opcodes)
+
+
+# Function to close a loop body with a jump back to the program start
+def loop(body):
+    return assemble(body + [0x1200])
+
+
+# 8XYN: register arithmetic across all ALU opcodes
+def alu_rom():
+    body = [0x6000 | (x << 8) | (x * 17) for x in range(15)]
+    alu_ops = [0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE]
+    while len(body) < LOOP_LENGTH:
+        k = len(body)
+        body.append(0x8000 | ((k % 15) << 8) | (((k * 7) % 15) << 4) | alu_ops[k % len(alu_ops)])
+    return loop(body)
+
+
+# 3XKK/4XKK/5XY0/9XY0: skips, half taken and half not
+def skip_rom():
+    body = [0x6000, 0x6101, 0x6200]
+    skips = [0x3000, 0x3001, 0x4000, 0x4001, 0x5020, 0x5010, 0x9010, 0x9020]
+    while len(body) < LOOP_LENGTH:
+        body.append(skips[len(body) % len(skips)])
+        body.append(0x7301)  # Skipped or not, keeps the loop length fixed
+    return loop(body)
+
+
+# 1NNN/2NNN/00EE: jump chains and subroutine calls
+def jump_rom():
+    # Subroutine at 0x300, the loop calls it and hops forward through a chain of jumps
+    body = []
+    while len(body) < LOOP_LENGTH:
+        address = 0x200 + 2 * len(body)
+        # The jump skips the filler word and lands on the next call
+        body += [0x2300, 0x1000 | (address + 6), 0x0000]
+    rom = bytearray(loop(body))
+    rom += bytes(0x100 - len(rom))
+    rom += assemble([0x7001, 0x00EE])
+    return bytes(rom)
+
+
+# DXYN: font sprites drawn across the screen, wrapping at the edges
+def draw_rom():
+    body = [0x6000, 0x6100, 0x6205]
+    while len(body) < LOOP_LENGTH:
+        body += [0xF229, 0xD015, 0x7009, 0x7107, 0x7201]
+    return loop(body)
+
+
+# FX55/FX65: register block moves
+def memory_rom():
+    body = [0xA400]
+    while len(body) < LOOP_LENGTH:
+        x = len(body) % 16
+        body += [0xF055 | (x << 8), 0xF065 | (x << 8)]
+    return loop(body)
+
+
+# FX33: BCD conversion of a counting register
+def bcd_rom():
+    body = [0xA400]
+    while len(body) < LOOP_LENGTH:
+        body += [0xF033 | ((len(body) % 15) << 8), 0x7003 | ((len(body) % 15) << 8)]
+    return loop(body)
+
+
+# SCHIP hi-res: 16x16 sprites and whole-screen scrolls at 128x64
+def hires_rom():
+    body = [0x00FF, 0xA050, 0x6000, 0x6100]
+    while len(body) < LOOP_LENGTH:
+        body += [0xD010, 0x7013, 0x710B, 0x00C1, 0x00FB, 0x00FC]
+    # Jump back past 00FF, which would clear the screen
+    return assemble(body + [0x1202])
+
+
+# Benchmark name -> ROM generator, one per opcode family
+ROMS = {
+    "alu": alu_rom,
+    "skips": skip_rom,
+    "jumps": jump_rom,
+    "draw": draw_rom,
+    "memory": memory_rom,
+    "bcd": bcd_rom,
+    "hires": hires_rom,
+}
@@ -1,14 +1,17 @@
 # cpu.py
 
 import random
-from py import std
 from globals import status_items
 from globals import log_debug
-from display import Display
+from display import Display, HeadlessDisplay
+from display import LOW_RES_WIDTH, LOW_RES_HEIGHT, HIGH_RES_WIDTH, HIGH_RES_HEIGHT
+from input import Keyboard, WaitForKey
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE, handler_overrides
 
 # Memory constants
 MEMORY_SIZE = 4096  # Total size for Chip-8 memory
 FONT_START = 0x050  # Start of fontset in memory
+BIG_FONT_START = 0x0A0  # Start of the SCHIP 8x10 fontset, right after the small one
 PROGRAM_START_ADDRESS = 0x200  # Start of program memory
 
 # Fontset for the Chip-8 (Each charachter is 4x5 pixels)
@@ -31,12 +34,135 @@ FONT_SET = [
     0xF0, 0x80, 0xF0, 0x80, 0x80   # F
 ]
 
+# SCHIP fontset for FX30 (Each charachter is 8x10 pixels)
+BIG_FONT_SET = [
+    0xFF, 0xFF, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF,  # 0
+    0x18, 0x78, 0x78, 0x18, 0x18, 0x18, 0x18, 0x18, 0xFF, 0xFF,  # 1
+    0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # 2
+    0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 3
+    0xC3, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0x03, 0x03,  # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 5
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 6
+    0xFF, 0xFF, 0x03, 0x03, 0x06, 0x0C, 0x18, 0x18, 0x18, 0x18,  # 7
+    0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF,  # 8
+    0xFF, 0xFF, 0xC3, 0xC3, 0xFF, 0xFF, 0x03, 0x03, 0xFF, 0xFF,  # 9
+    0x7E, 0xFF, 0xC3, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3,  # A
+    0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFC, 0xFC,  # B
+    0x3C, 0xFF, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0xFF, 0x3C,  # C
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC,  # D
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF,  # E
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFF, 0xFF, 0xC0, 0xC0, 0xC0, 0xC0   # F
+]
+
+
+# Opcode decode tables, each entry names the handler method and the operands it takes
+
+# 0NNN opcodes, keyed by the full opcode
+SYSTEM_OPCODES = {
+    0x00E0: ("op_00e0", ""),
+    0x00EE: ("op_00ee", ""),
+    0x00FB: ("op_00fb", ""),
+    0x00FC: ("op_00fc", ""),
+    0x00FD: ("op_00fd", ""),
+    0x00FE: ("op_00fe", ""),
+    0x00FF: ("op_00ff", ""),
+}
+
+# 00CN and 00DN scroll opcodes, keyed by the opcode without N
+SCROLL_OPCODES = {
+    0x00C0: ("op_00cn", "n"),
+    0x00D0: ("op_00dn", "n"),
+}
+
+# Opcodes identified by their first nibble alone
+PRIMARY_OPCODES = {
+    0x1: ("op_1nnn", "nnn"),
+    0x2: ("op_2nnn", "nnn"),
+    0x3: ("op_3xkk", "xkk"),
+    0x4: ("op_4xkk", "xkk"),
+    0x5: ("op_5xy0", "xy"),
+    0x6: ("op_6xkk", "xkk"),
+    0x7: ("op_7xkk", "xkk"),
+    0x9: ("op_9xy0", "xy"),
+    0xA: ("op_annn", "nnn"),
+    0xB: ("op_bnnn", "nnn"),
+    0xC: ("op_cxkk", "xkk"),
+    0xD: ("op_dxyn", "xyn"),
+}
+
+# DXY0 draws a 16x16 sprite, keyed by the opcode without X and Y
+LARGE_SPRITE_OPCODES = {
+    0xD000: ("op_dxy0", "xy"),
+}
+
+# 8XYN opcodes, keyed by the last nibble
+ALU_OPCODES = {
+    0x0: ("op_8xy0", "xy"),
+    0x1: ("op_8xy1", "xy"),
+    0x2: ("op_8xy2", "xy"),
+    0x3: ("op_8xy3", "xy"),
+    0x4: ("op_8xy4", "xy"),
+    0x5: ("op_8xy5", "xy"),
+    0x6: ("op_8xy6", "xy"),
+    0x7: ("op_8xy7", "xy"),
+    0xE: ("op_8xye", "xy"),
+}
+
+# EXKK opcodes, keyed by the last byte
+KEY_OPCODES = {
+    0x9E: ("op_ex9e", "x"),
+    0xA1: ("op_exa1", "x"),
+}
+
+# FXKK opcodes, keyed by the last byte
+MISC_OPCODES = {
+    0x07: ("op_fx07", "x"),
+    0x0A: ("op_fx0a", "x"),
+    0x15: ("op_fx15", "x"),
+    0x18: ("op_fx18", "x"),
+    0x1E: ("op_fx1e", "x"),
+    0x29: ("op_fx29", "x"),
+    0x30: ("op_fx30", "x"),
+    0x33: ("op_fx33", "x"),
+    0x55: ("op_fx55", "x"),
+    0x65: ("op_fx65", "x"),
+    0x75: ("op_fx75", "x"),
+    0x85: ("op_fx85", "x"),
+}
+
+
+# Function to find how many instructions one pass around an idle loop takes, for the 1NNN at address jumping
+# back to target, or None if the jump doesn't close an idle loop
+# Idle loops are a jump to itself, an EX9E/EXA1 key poll and an FX07 / 3XKK or 4XKK delay timer poll
+def idle_loop_period(memory, target, address):
+    if target == address:
+        return 1
+    if target == address - 2:
+        key_poll = memory[target] << 8 | memory[target + 1]
+        if key_poll & 0xF0FF in (0xE09E, 0xE0A1):
+            return 2
+    elif target == address - 4:
+        timer_read = memory[target] << 8 | memory[target + 1]
+        skip = memory[target + 2] << 8 | memory[target + 3]
+        if timer_read & 0xF0FF == 0xF007 and skip >> 12 in (0x3, 0x4) and skip & 0x0F00 == timer_read & 0x0F00:
+            return 3
+    return None
+
+
+# Raised by a jump closing an idle loop, further passes change nothing until a timer tick or key event
+class IdleLoop(Exception):
+    def __init__(self, period):
+        super().__init__(period)
+        self.period = period  # Instructions in one pass around the loop
+
 
 # Chip-8 CPU class
 class CPU:
-    def __init__(self, stdscr):
-        # Initialize the Display
-        self.display = Display(stdscr)
+    def __init__(self, stdscr=None, display=None, jit=False, seed=None, quirks=DEFAULT_PROFILE):
+        # Initialize the Display, without a curses screen the CPU runs headless
+        if display is None:
+            display = Display(stdscr) if stdscr is not None else HeadlessDisplay()
+        self.display = display
 
         # Initialize the registers and memory pointers
         self.v = [0] * 16  # 16 8-bit registers V0 - VF
@@ -47,10 +173,50 @@ class CPU:
         self.delay_timer = 0
         self.sound_timer = 0
         self.keys = [0] * 16  # Key states for Chip-8 keys
+        self.keyboard = Keyboard(self.keys, lambda: self.cycles)  # Key events, feeds keys and FX0A
+        self.cycles = 0  # Instructions executed so far
+        self.unknown_opcodes = 0  # Unknown opcodes hit so far
+        # xorshift32 state for CXKK, seeded to make a run reproducible and seeded like LockstepMachines
+        # A zero state would stay zero so seeds are forced odd
+        self.rng_state = (random.getrandbits(32) if seed is None else seed * 2 + 1) & 0xFFFFFFFF | 1
+        self.rpl_flags = [0] * 16  # SCHIP RPL user flags, saved and loaded by FX75/FX85
+        self.exited = False  # Set once 00FD exits the program
+        self.idle_cycles = 0  # Instructions skipped inside idle loops, included in cycles
 
         # Initialize the memory
         self.memory = bytearray([0] * MEMORY_SIZE)
+
+        # Predecoded instruction cache, one (handler, operands, opcode) entry per address
+        self.decoded = [None] * MEMORY_SIZE
+
+        # Optional basic-block JIT, the interpreter stays the fallback for what it can't compile
+        self.jit = None
+
+        # Instruction trace buffer, only set while tracing is enabled
+        self.trace = None
+
+        # (owner, step function) pairs swapped in for step by tracing, the profiler and the debugger, innermost first
+        # Each owner's next_step is the step function below its own, which it calls to run the instruction
+        self.step_hooks = []
         self.initialize_memory()
+        if jit:
+            # Imported here since jit.py needs the memory constants from this module
+            from jit import BlockCompiler
+            self.jit = BlockCompiler(self)
+
+        # Quirk profile, see quirks.py, its handler variants are bound when instructions are decoded
+        self.set_quirks(quirks)
+
+    # Function to choose the quirk profile, its handler variants and sprite clipping are bound here once
+    # so no handler checks a quirk flag
+    def set_quirks(self, profile):
+        self.quirk_profile = profile
+        self.quirks = QUIRK_PROFILES[profile]
+        self.handler_overrides = handler_overrides(profile)  # Handler name -> name of the variant bound instead
+        self.display.set_sprite_clipping(self.quirks["clip"])
+
+        # Cached decodes and compiled blocks were made for the previous profile
+        self.invalidate_code(0, MEMORY_SIZE)
 
     # Function to read memory
     def read_memory(self, address, length=1):
@@ -60,6 +226,7 @@ class CPU:
     def write_memory(self, address, data):
         for i in range(len(data)):
             self.memory[address + i] = data[i]
+        self.invalidate_code(address, len(data))
 
     # Initialize the memory, clear and load the fontset
 
@@ -71,250 +238,385 @@ class CPU:
         # Load the fontset into memory
         for i in range(len(FONT_SET)):
             self.memory[FONT_START + i] = FONT_SET[i]
+        self.memory[BIG_FONT_START:BIG_FONT_START + len(BIG_FONT_SET)] = bytes(BIG_FONT_SET)
+
+        self.invalidate_code(0, MEMORY_SIZE)
 
     # Function to load a program into memory
 
     def load_rom(self, rom_path):
         with open(rom_path, "rb") as rom_file:
             rom_data = rom_file.read()
-            for i in range(len(rom_data)):
-                self.memory[PROGRAM_START_ADDRESS + i] = rom_data[i]
+        self.load_program(rom_data)
 
         # Update the status dictionary item 'rom' with the ROM filename
         status_items["rom"] = f"{rom_path.split('/')[-1]} loaded"
+        log_debug("Loaded ROM %s (%d bytes)", rom_path, len(rom_data))
+
+    # Function to load program bytes into memory at the program start address
+    def load_program(self, rom_data):
+        if len(rom_data) > MEMORY_SIZE - PROGRAM_START_ADDRESS:
+            raise ValueError(f"ROM is {len(rom_data)} bytes, at most {MEMORY_SIZE - PROGRAM_START_ADDRESS} fit in memory")
+        self.memory[PROGRAM_START_ADDRESS:PROGRAM_START_ADDRESS + len(rom_data)] = rom_data
+        self.invalidate_code(PROGRAM_START_ADDRESS, len(rom_data))
 
     # Function to fetch the next opcode (2 bytes) from memory
     def fetch_opcode(self):
         opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
         return opcode
 
-    # Function to decode and execute an opcode
+    # Function to decode an opcode into its handler and pre-extracted operands
+    def decode_opcode(self, opcode):
+        first_nibble = (opcode & 0xF000) >> 12
+
+        if first_nibble == 0x0:
+            entry = SYSTEM_OPCODES.get(opcode) or SCROLL_OPCODES.get(opcode & 0xFFF0)
+        elif first_nibble == 0x8:
+            entry = ALU_OPCODES.get(opcode & 0x000F)
+        elif first_nibble == 0xE:
+            entry = KEY_OPCODES.get(opcode & 0x00FF)
+        elif first_nibble == 0xF:
+            entry = MISC_OPCODES.get(opcode & 0x00FF)
+        elif first_nibble == 0xD:
+            entry = LARGE_SPRITE_OPCODES.get(opcode & 0xF00F) or PRIMARY_OPCODES[first_nibble]
+        else:
+            entry = PRIMARY_OPCODES[first_nibble]
+
+        if entry is None:
+            return self.unknown_opcode, (opcode,), opcode
+
+        handler_name, operands = entry
+        x = (opcode & 0x0F00) >> 8
+        y = (opcode & 0x00F0) >> 4
+
+        if operands == "nnn":
+            args = (opcode & 0x0FFF,)
+        elif operands == "x":
+            args = (x,)
+        elif operands == "xkk":
+            args = (x, opcode & 0x00FF)
+        elif operands == "xy":
+            args = (x, y)
+        elif operands == "xyn":
+            args = (x, y, opcode & 0x000F)
+        elif operands == "n":
+            args = (opcode & 0x000F,)
+        else:
+            args = ()
+
+        return getattr(self, self.handler_overrides.get(handler_name, handler_name)), args, opcode
+
+    # Function to decode the instruction at an address, a jump closing an idle loop gets the idle loop handler
+    def decode_at(self, address):
+        opcode = self.memory[address] << 8 | self.memory[address + 1]
+        if opcode & 0xF000 == 0x1000 and idle_loop_period(self.memory, opcode & 0x0FFF, address) is not None:
+            return self.op_1nnn_idle, (opcode & 0x0FFF, address), opcode
+        return self.decode_opcode(opcode)
+
+    # Function to drop cached decodes overlapping a memory write
+    def invalidate_code(self, address, length=1):
+        # An opcode starting one byte before the write also changes
+        start = max(address - 1, 0)
+        end = min(address + length, MEMORY_SIZE)
+        self.decoded[start:end] = [None] * (end - start)
+        if self.jit is not None:
+            self.jit.invalidate(address, length)
+
+    # Function to decode and execute an opcode as if it were the instruction at PC, counted like step counts it
     def execute_opcode(self, opcode):
-        # Program counter flag to indicate if it has changed
-        pc_changed = False
-
-        # Update the status dictionary item 'opcode' with the current opcode
-        # Format the opcode as a 4-digit hexadecimal number
-        status_items["opcode"] = f"{opcode:04X}"
-
-        # Decode and execute the opcode
-        first_nibble = opcode & 0xF000
-
-        log_debug(f"Executing opcode: {opcode:04X}")
-
-        if first_nibble == 0x0000:
-            if opcode == 0x00E0:
-                log_debug(f"Opcode 00E0: Clear the screen")
-                self.clear_screen()
-            elif opcode == 0x00EE:
-                log_debug(f"Opcode 00EE: Return from subroutine")
-                self.return_from_subroutine()
-            else:
-                self.unknown_opcode(opcode)
-
-        elif first_nibble == 0x1000:  # 1NNN: Jump to address NNN
-            address = opcode & 0x0FFF
-            log_debug(f"Opcode 1NNN: Jump to address {address:04X}")
-            self.pc = address
-            pc_changed = True
-
-        elif first_nibble == 0x2000:  # 2NNN: Call subroutine at NNN
-            address = opcode & 0x0FFF
-            log_debug(f"Opcode 2NNN: Call subroutine at {address:04X}")
-            self.stack.append(self.pc)
-            self.sp += 1
-            self.pc = address
-            pc_changed = True
-
-        elif first_nibble == 0x3000:  # 3XKK: Skip next instruction if Vx == kk
-            x = (opcode & 0x0F00) >> 8
-            kk = opcode & 0x00FF
-            log_debug(f"Opcode 3Xnn: Checking V{x} = {self.v[x]:02X} against kk = {kk:02X}")
-            if self.v[x] == kk:
-                self.pc += 2
-                pc_changed = True
-                log_debug(f"Opcode 3Xnn: Skipping next instruction, PC = {self.pc:04X}")
-
-        elif first_nibble == 0x4000:  # 4XKK: Skip next instruction if Vx != kk
-            x = (opcode & 0x0F00) >> 8
-            kk = opcode & 0x00FF
-            log_debug(f"Opcode 4Xnn: Checking V{x} != {kk:02X}")
-            if self.v[x] != kk:
-                self.pc += 2
-                pc_changed = True
-
-        elif first_nibble == 0x5000:  # 5XY0: Skip next instruction if Vx == Vy
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            log_debug(f"Opcode 5XY0: Checking V{x} == V{y}")
-            if self.v[x] == self.v[y]:
-                self.pc += 2
-                pc_changed = True
-
-        elif first_nibble == 0x6000:  # 6XKK: Set Vx = kk
-            x = (opcode & 0x0F00) >> 8
-            kk = opcode & 0x00FF
-            log_debug(f"Opcode 6XKK: Setting V{x} = {kk:02X}")
-            self.v[x] = kk
-
-        elif first_nibble == 0x7000:  # 7XKK: Set Vx = Vx + kk
-            x = (opcode & 0x0F00) >> 8
-            kk = opcode & 0x00FF
-            log_debug(f"Opcode 7XKK: Adding kk = {kk:02X} to V{x} = {self.v[x]:02X}")
-            self.v[x] = (self.v[x] + kk) & 0xFF
-
-        elif first_nibble == 0x8000:
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            last_nibble = opcode & 0x000F
-
-            if last_nibble == 0x0:  # 8XY0: Set Vx = Vy
-                log_debug(f"Opcode 8XY0: Setting V{x} = V{y}")
-                self.v[x] = self.v[y]
-            elif last_nibble == 0x1:  # 8XY1: Set Vx = Vx OR Vy
-                log_debug(f"Opcode 8XY1: Setting V{x} = V{x} | V{y}")
-                self.v[x] |= self.v[y]
-            elif last_nibble == 0x2:  # 8XY2: Set Vx = Vx AND Vy
-                log_debug(f"Opcode 8XY2: Setting V{x} = V{x} & V{y}")
-                self.v[x] &= self.v[y]
-            elif last_nibble == 0x3:  # 8XY3: Set Vx = Vx XOR Vy
-                log_debug(f"Opcode 8XY3: Setting V{x} = V{x} ^ V{y}")
-                self.v[x] ^= self.v[y]
-            elif last_nibble == 0x4:  # 8XY4: Set Vx = Vx + Vy, set VF = carry
-                result = self.v[x] + self.v[y]
-                log_debug(f"Opcode 8XY4: Adding V{y} = {self.v[y]:02X} to V{x} = {self.v[x]:02X}, setting VF = {1 if result > 0xFF else 0}")
-                self.v[0xF] = 1 if result > 0xFF else 0
-                self.v[x] = result & 0xFF
-            elif last_nibble == 0x5:  # 8XY5: Set Vx = Vx - Vy, set VF = NOT borrow
-                result = self.v[x] - self.v[y]
-                log_debug(f"Opcode 8XY5: Subtracting V{y} from V{x}, setting VF = {1 if self.v[x] >= self.v[y] else 0}")
-                self.v[0xF] = 1 if self.v[x] >= self.v[y] else 0
-                self.v[x] = result & 0xFF
-            elif last_nibble == 0x6:  # 8XY6: Set Vx = Vx SHR 1
-                log_debug(f"Opcode 8XY6: Shifting V{x} right by 1, setting VF = {self.v[x] & 0x1}")
-                self.v[0xF] = self.v[x] & 0x1
-                self.v[x] >>= 1
-            elif last_nibble == 0x7:  # 8XY7: Set Vx = Vy - Vx, set VF = NOT borrow
-                result = self.v[y] - self.v[x]
-                log_debug(f"Opcode 8XY7: Subtracting V{x} from V{y}, setting VF = {1 if self.v[y] >= self.v[x] else 0}")
-                self.v[0xF] = 1 if self.v[y] >= self.v[x] else 0
-                self.v[x] = result & 0xFF
-            elif last_nibble == 0xE:  # 8XYE: Set Vx = Vx SHL 1
-                log_debug(f"Opcode 8XYE: Shifting V{x} left by 1, setting VF = {(self.v[x] & 0x80) >> 7}")
-                self.v[0xF] = (self.v[x] & 0x80) >> 7
-                self.v[x] = (self.v[x] << 1) & 0xFF
-            else:
-                self.unknown_opcode(opcode)
-
-        elif first_nibble == 0x9000:  # 9XY0: Skip next instruction if Vx != Vy
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            log_debug(f"Opcode 9XY0: Checking V{x} != V{y}")
-            if self.v[x] != self.v[y]:
-                self.pc += 2
-                pc_changed = True
-
-        elif first_nibble == 0xA000:  # ANNN: Set I = NNN
-            self.i = opcode & 0x0FFF
-            log_debug(f"Opcode ANNN: Setting I = {self.i:04X}")
-
-        elif first_nibble == 0xB000:  # BNNN: Jump to address NNN + V0
-            self.pc = (opcode & 0x0FFF) + self.v[0]
-            pc_changed = True
-            log_debug(f"Opcode BNNN: Jumping to address {self.pc:04X} (NNN + V0)")
-
-        elif first_nibble == 0xC000:  # CXKK: Set Vx = random byte AND kk
-            x = (opcode & 0x0F00) >> 8
-            kk = opcode & 0x00FF
-            random_value = random.randint(0, 255)
-            self.v[x] = random_value & kk
-            log_debug(f"Opcode CXKK: Setting V{x} to random byte AND {kk:02X}, value = {self.v[x]:02X}")
-
-        elif first_nibble == 0xD000:  # DXYN: Display n-byte sprite at (Vx, Vy)
-            x = (opcode & 0x0F00) >> 8
-            y = (opcode & 0x00F0) >> 4
-            n = opcode & 0x000F
-            log_debug(f"Opcode DXYN: Drawing sprite at (V{x}, V{y}) with height {n}")
-            self.draw_sprite(self.v[x], self.v[y], n)
-
-        elif first_nibble == 0xE000:
-            x = (opcode & 0x0F00) >> 8
-            if (opcode & 0x00FF) == 0x9E:  # EX9E: Skip next instruction if key with the value of Vx is pressed
-                log_debug(f"Opcode EX9E: Skipping if key in V{x} is pressed")
-                pass  # TODO: Implement key handling
-            elif (opcode & 0x00FF) == 0xA1:  # EXA1: Skip next instruction if key with the value of Vx is not pressed
-                log_debug(f"Opcode EXA1: Skipping if key in V{x} is not pressed")
-                pass  # TODO: Implement key handling
-            else:
-                self.unknown_opcode(opcode)
-
-        elif first_nibble == 0xF000:
-            x = (opcode & 0x0F00) >> 8
-            last_byte = opcode & 0x00FF
-
-            if last_byte == 0x07:  # FX07: Set Vx = delay timer value
-                log_debug(f"Opcode FX07: Setting V{x} = delay timer ({self.delay_timer})")
-                self.v[x] = self.delay_timer
-            elif last_byte == 0x0A:  # FX0A: Wait for a key press, store the value of the key in Vx
-                log_debug(f"Opcode FX0A: Waiting for a key press")
-                self.v[x] = self.wait_for_key_press()
-            elif last_byte == 0x15:  # FX15: Set delay timer = Vx
-                log_debug(f"Opcode FX15: Setting delay timer = V{x} ({self.v[x]:02X})")
-                self.delay_timer = self.v[x]
-            elif last_byte == 0x18:  # FX18: Set sound timer = Vx
-                log_debug(f"Opcode FX18: Setting sound timer = V{x} ({self.v[x]:02X})")
-                self.sound_timer = self.v[x]
-            elif last_byte == 0x1E:  # FX1E: Set I = I + Vx
-                log_debug(f"Opcode FX1E: Adding V{x} = {self.v[x]:02X} to I = {self.i:04X}")
-                self.i = (self.i + self.v[x]) & 0xFFFF
-            elif last_byte == 0x29:  # FX29: Set I = location of sprite for digit Vx
-                log_debug(f"Opcode FX29: Setting I = location of sprite for digit V{x}")
-                self.i = FONT_START + (self.v[x] * 5)
-            elif last_byte == 0x33:  # FX33: Store BCD representation of Vx in memory locations I, I+1, and I+2
-                log_debug(f"Opcode FX33: Storing BCD of V{x} = {self.v[x]:02X} at memory location I")
-                self.memory[self.i] = self.v[x] // 100
-                self.memory[self.i + 1] = (self.v[x] // 10) % 10
-                self.memory[self.i + 2] = (self.v[x] % 10)
-            elif last_byte == 0x55:  # FX55: Store registers V0 through Vx in memory starting at location I
-                log_debug(f"Opcode FX55: Storing registers V0 through V{x} starting at I = {self.i:04X}")
-                for register_index in range(x + 1):
-                    self.memory[self.i + register_index] = self.v[register_index]
-            elif last_byte == 0x65:  # FX65: Read registers V0 through Vx from memory starting at location I
-                log_debug(f"Opcode FX65: Reading registers V0 through V{x} from I = {self.i:04X}")
-                for register_index in range(x + 1):
-                    self.v[register_index] = self.memory[self.i + register_index]
-            else:
-                self.unknown_opcode(opcode)
-
+        handler, args, _ = self.decode_opcode(opcode)
+
+        # Handlers see the program counter already pointing at the next instruction
+        self.cycles += 1
+        self.pc += 2
+        try:
+            handler(*args)
+        except WaitForKey:
+            # FX0A is waiting, it already put PC and cycles back
+            pass
+
+    # Function to execute the instruction at PC through the predecoded instruction cache
+    def step(self):
+        pc = self.pc
+        decoded = self.decoded[pc]
+        if decoded is None:
+            decoded = self.decoded[pc] = self.decode_at(pc)
+        handler, args, _ = decoded
+
+        self.cycles += 1
+        self.pc = pc + 2
+        handler(*args)
+
+    # Function to swap in a step function wrapping the current one, owner.next_step is set to the one it wraps
+    def add_step_hook(self, owner, step):
+        owner.next_step = self.step
+        self.step_hooks.append((owner, step))
+        self.step = step
+
+    # Function to take owner's step function out of the chain, whichever position it is in
+    def remove_step_hook(self, owner):
+        index = [hook_owner for hook_owner, _ in self.step_hooks].index(owner)
+        del self.step_hooks[index]
+        if index < len(self.step_hooks):
+            # The hook above now wraps what the removed one wrapped
+            self.step_hooks[index][0].next_step = owner.next_step
+        elif self.step_hooks:
+            self.step = self.step_hooks[-1][1]
         else:
-            self.unknown_opcode(opcode)
+            del self.step
+
+    # Function to record a trace entry and then step, swapped in for step while tracing is enabled
+    def traced_step(self):
+        pc = self.pc
+        self.trace.record(self.cycles, pc, self.memory[pc] << 8 | self.memory[pc + 1], self.i, self.v)
+        self.trace.next_step()
+
+    # Function to start recording every executed instruction into a TraceBuffer
+    def enable_tracing(self, trace):
+        self.trace = trace
+        self.add_step_hook(trace, self.traced_step)
+
+    # Function to stop tracing, flushing whatever is still buffered
+    def disable_tracing(self):
+        if self.trace is None:
+            return
+        self.remove_step_hook(self.trace)
+        self.trace.close()
+        self.trace = None
+
+    # Opcode handlers, PC already points at the next instruction when they run
+
+    def op_00e0(self):  # 00E0: Clear the screen
+        self.clear_screen()
+
+    def op_00ee(self):  # 00EE: Return from subroutine
+        self.return_from_subroutine()
+
+    def op_00cn(self, n):  # 00CN: Scroll the screen down N rows
+        self.display.scroll_down(n)
+
+    def op_00dn(self, n):  # 00DN: Scroll the screen up N rows
+        self.display.scroll_up(n)
+
+    def op_00fb(self):  # 00FB: Scroll the screen right 4 pixels
+        self.display.scroll_right(4)
+
+    def op_00fc(self):  # 00FC: Scroll the screen left 4 pixels
+        self.display.scroll_left(4)
+
+    def op_00fd(self):  # 00FD: Exit the program
+        # Stay on this instruction, the rest of every batch is skipped like an idle jump to itself
+        self.pc -= 2
+        if not self.exited:
+            self.exited = True
+            status_items["error"] = "Program exited"
+            log_debug("Program exited at %03X", self.pc)
+        raise IdleLoop(1)
+
+    def op_00fe(self):  # 00FE: Switch to the 64x32 low resolution
+        self.display.set_resolution(LOW_RES_WIDTH, LOW_RES_HEIGHT)
+
+    def op_00ff(self):  # 00FF: Switch to the 128x64 high resolution
+        self.display.set_resolution(HIGH_RES_WIDTH, HIGH_RES_HEIGHT)
+
+    def op_1nnn(self, address):  # 1NNN: Jump to address NNN
+        self.pc = address
+
+    def op_1nnn_idle(self, address, jump_address):  # 1NNN: Jump to address NNN, closing an idle loop
+        self.pc = address
+        # The loop body sits before the jump, so writes to it don't drop this decode and it is checked again here
+        period = idle_loop_period(self.memory, address, jump_address)
+        if period is not None and self.loop_is_idle(address, period):
+            raise IdleLoop(period)
+
+    def op_2nnn(self, address):  # 2NNN: Call subroutine at NNN
+        self.stack.append(self.pc)
+        self.sp += 1
+        self.pc = address
+
+    def op_3xkk(self, x, kk):  # 3XKK: Skip next instruction if Vx == kk
+        if self.v[x] == kk:
+            self.pc += 2
+
+    def op_4xkk(self, x, kk):  # 4XKK: Skip next instruction if Vx != kk
+        if self.v[x] != kk:
+            self.pc += 2
+
+    def op_5xy0(self, x, y):  # 5XY0: Skip next instruction if Vx == Vy
+        if self.v[x] == self.v[y]:
+            self.pc += 2
+
+    def op_6xkk(self, x, kk):  # 6XKK: Set Vx = kk
+        self.v[x] = kk
+
+    def op_7xkk(self, x, kk):  # 7XKK: Set Vx = Vx + kk
+        self.v[x] = (self.v[x] + kk) & 0xFF
+
+    def op_8xy0(self, x, y):  # 8XY0: Set Vx = Vy
+        self.v[x] = self.v[y]
+
+    def op_8xy1(self, x, y):  # 8XY1: Set Vx = Vx OR Vy
+        self.v[x] |= self.v[y]
+
+    def op_8xy2(self, x, y):  # 8XY2: Set Vx = Vx AND Vy
+        self.v[x] &= self.v[y]
+
+    def op_8xy3(self, x, y):  # 8XY3: Set Vx = Vx XOR Vy
+        self.v[x] ^= self.v[y]
+
+    def op_8xy1_vf_reset(self, x, y):  # 8XY1: Set Vx = Vx OR Vy, set VF = 0 (vf_reset quirk)
+        self.v[x] |= self.v[y]
+        self.v[0xF] = 0
+
+    def op_8xy2_vf_reset(self, x, y):  # 8XY2: Set Vx = Vx AND Vy, set VF = 0 (vf_reset quirk)
+        self.v[x] &= self.v[y]
+        self.v[0xF] = 0
+
+    def op_8xy3_vf_reset(self, x, y):  # 8XY3: Set Vx = Vx XOR Vy, set VF = 0 (vf_reset quirk)
+        self.v[x] ^= self.v[y]
+        self.v[0xF] = 0
+
+    def op_8xy4(self, x, y):  # 8XY4: Set Vx = Vx + Vy, set VF = carry
+        result = self.v[x] + self.v[y]
+        self.v[0xF] = 1 if result > 0xFF else 0
+        self.v[x] = result & 0xFF
+
+    def op_8xy5(self, x, y):  # 8XY5: Set Vx = Vx - Vy, set VF = NOT borrow
+        result = self.v[x] - self.v[y]
+        self.v[0xF] = 1 if self.v[x] >= self.v[y] else 0
+        self.v[x] = result & 0xFF
+
+    def op_8xy6(self, x, y):  # 8XY6: Set Vx = Vx SHR 1
+        self.v[0xF] = self.v[x] & 0x1
+        self.v[x] >>= 1
 
-        if not pc_changed:  # If the program counter has not been changed
+    def op_8xy6_vy(self, x, y):  # 8XY6: Set Vx = Vy SHR 1 (shift_vy quirk)
+        value = self.v[y]
+        self.v[0xF] = value & 0x1
+        self.v[x] = value >> 1
+
+    def op_8xy7(self, x, y):  # 8XY7: Set Vx = Vy - Vx, set VF = NOT borrow
+        result = self.v[y] - self.v[x]
+        self.v[0xF] = 1 if self.v[y] >= self.v[x] else 0
+        self.v[x] = result & 0xFF
+
+    def op_8xye(self, x, y):  # 8XYE: Set Vx = Vx SHL 1
+        self.v[0xF] = (self.v[x] & 0x80) >> 7
+        self.v[x] = (self.v[x] << 1) & 0xFF
+
+    def op_8xye_vy(self, x, y):  # 8XYE: Set Vx = Vy SHL 1 (shift_vy quirk)
+        value = self.v[y]
+        self.v[0xF] = (value & 0x80) >> 7
+        self.v[x] = (value << 1) & 0xFF
+
+    def op_9xy0(self, x, y):  # 9XY0: Skip next instruction if Vx != Vy
+        if self.v[x] != self.v[y]:
             self.pc += 2
 
-        log_debug(f"PC after opcode execution: {self.pc:04X}")
-
-    def wait_for_key_press(self):
-        # Loop until a key is pressed
-        while True:
-            key = self.display.stdscr.getch()  # Get a key press from ncurses
-            if key != -1:  # A key was pressed
-                chip8_key = self.map_key_to_chip8(key)
-                if chip8_key != -1:  # Ensure the key is mapped
-                    return chip8_key
-                
+    def op_annn(self, address):  # ANNN: Set I = NNN
+        self.i = address
+
+    def op_bnnn(self, address):  # BNNN: Jump to address NNN + V0
+        self.pc = address + self.v[0]
+
+    def op_bxnn(self, address):  # BXNN: Jump to address XNN + VX (jump_vx quirk)
+        self.pc = address + self.v[address >> 8]
+
+    # Function to advance the xorshift32 generator and return its top byte
+    def random_byte(self):
+        state = self.rng_state
+        state ^= (state << 13) & 0xFFFFFFFF
+        state ^= state >> 17
+        state ^= (state << 5) & 0xFFFFFFFF
+        self.rng_state = state
+        return state >> 24
+
+    def op_cxkk(self, x, kk):  # CXKK: Set Vx = random byte AND kk
+        self.v[x] = self.random_byte() & kk
+
+    def op_dxyn(self, x, y, n):  # DXYN: Display n-byte sprite at (Vx, Vy)
+        self.draw_sprite(self.v[x], self.v[y], n)
+
+    def op_dxy0(self, x, y):  # DXY0: Display 16x16 sprite at (Vx, Vy), two bytes per row
+        data = self.memory[self.i:self.i + 32]
+        sprite = [data[index] << 8 | data[index + 1] for index in range(0, len(data) - 1, 2)]
+        self.v[0xF] = self.display.draw_sprite(self.v[x], self.v[y], sprite, 16)
+
+    def op_ex9e(self, x):  # EX9E: Skip next instruction if key with the value of Vx is pressed
+        if self.is_key_pressed(self.v[x]):
+            self.pc += 2
+
+    def op_exa1(self, x):  # EXA1: Skip next instruction if key with the value of Vx is not pressed
+        if not self.is_key_pressed(self.v[x]):
+            self.pc += 2
+
+    def op_fx07(self, x):  # FX07: Set Vx = delay timer value
+        self.v[x] = self.delay_timer
+
+    def op_fx0a(self, x):  # FX0A: Wait for a key press, store the value of the key in Vx
+        # Cycles don't advance while waiting, so every retry asks for presses since the same cycle
+        key = self.keyboard.next_press(self.cycles - 1)
+        if key is None:
+            # Stay on this instruction without counting it and end the batch, the scheduler sleeps until the next frame
+            self.pc -= 2
+            self.cycles -= 1
+            raise WaitForKey()
+        self.v[x] = key
+
+    def op_fx15(self, x):  # FX15: Set delay timer = Vx
+        self.delay_timer = self.v[x]
+
+    def op_fx18(self, x):  # FX18: Set sound timer = Vx
+        self.sound_timer = self.v[x]
+
+    def op_fx1e(self, x):  # FX1E: Set I = I + Vx
+        self.i = (self.i + self.v[x]) & 0xFFFF
+
+    def op_fx29(self, x):  # FX29: Set I = location of sprite for digit Vx
+        self.i = FONT_START + (self.v[x] * 5)
+
+    def op_fx30(self, x):  # FX30: Set I = location of the 8x10 sprite for digit Vx
+        self.i = BIG_FONT_START + (self.v[x] & 0xF) * 10
+
+    def op_fx33(self, x):  # FX33: Store BCD representation of Vx in memory locations I, I+1, and I+2
+        self.memory[self.i] = self.v[x] // 100
+        self.memory[self.i + 1] = (self.v[x] // 10) % 10
+        self.memory[self.i + 2] = (self.v[x] % 10)
+        self.invalidate_code(self.i, 3)
+
+    def op_fx55(self, x):  # FX55: Store registers V0 through Vx in memory starting at location I
+        for register_index in range(x + 1):
+            self.memory[self.i + register_index] = self.v[register_index]
+        self.invalidate_code(self.i, x + 1)
+
+    def op_fx65(self, x):  # FX65: Read registers V0 through Vx from memory starting at location I
+        for register_index in range(x + 1):
+            self.v[register_index] = self.memory[self.i + register_index]
+
+    def op_fx55_increment(self, x):  # FX55: Store V0 through Vx at I, then I = I + X + 1 (index_increment quirk)
+        self.op_fx55(x)
+        self.i = (self.i + x + 1) & 0xFFFF
+
+    def op_fx65_increment(self, x):  # FX65: Read V0 through Vx from I, then I = I + X + 1 (index_increment quirk)
+        self.op_fx65(x)
+        self.i = (self.i + x + 1) & 0xFFFF
+
+    def op_fx55_increment_x(self, x):  # FX55: Store V0 through Vx at I, then I = I + X (index_increment quirk)
+        self.op_fx55(x)
+        self.i = (self.i + x) & 0xFFFF
+
+    def op_fx65_increment_x(self, x):  # FX65: Read V0 through Vx from I, then I = I + X (index_increment quirk)
+        self.op_fx65(x)
+        self.i = (self.i + x) & 0xFFFF
+
+    def op_fx75(self, x):  # FX75: Store V0 through Vx in the RPL user flags
+        self.rpl_flags[:x + 1] = self.v[:x + 1]
+
+    def op_fx85(self, x):  # FX85: Read V0 through Vx from the RPL user flags
+        self.v[:x + 1] = self.rpl_flags[:x + 1]
+
     def is_key_pressed(self, key_value):
-        return self.keys[key_value] == 1  # Return True if the key is pressed
-
-    def map_key_to_chip8(self, key):
-        # Example key mapping (adjust according to your specific setup)
-        key_map = {
-            ord('1'): 0x1, ord('2'): 0x2, ord('3'): 0x3, ord('4'): 0xC,
-            ord('q'): 0x4, ord('w'): 0x5, ord('e'): 0x6, ord('r'): 0xD,
-            ord('a'): 0x7, ord('s'): 0x8, ord('d'): 0x9, ord('f'): 0xE,
-            ord('z'): 0xA, ord('x'): 0x0, ord('c'): 0xB, ord('v'): 0xF,
-        }
-        return key_map.get(key, -1)  # Return -1 if the key is not mapped
+        return self.keys[key_value & 0xF] == 1  # Return True if the key is pressed
 
     # Function to clear the screen
     def clear_screen(self):
@@ -332,18 +634,65 @@ class CPU:
     # Function to return from a subroutine
     def return_from_subroutine(self):
         self.pc = self.stack.pop()
+        self.sp -= 1
 
     # Function to update error in the status dictionary if we encounter an unknown opcode
     def unknown_opcode(self, opcode):
         status_items["error"] = f"Unknown opcode: {opcode:X}"
-
-    # Main loop to fetch, decode, and execute instructions
+        self.unknown_opcodes += 1
+        log_debug("Unknown opcode %04X at %03X", opcode, self.pc - 2)
+
+    # Function to check whether the next pass around the idle loop at address stays inside it
+    def loop_is_idle(self, address, period):
+        if period == 1:
+            return True
+        opcode = self.memory[address] << 8 | self.memory[address + 1]
+        x = (opcode & 0x0F00) >> 8
+        if period == 2:
+            # EX9E leaves the loop once the key is pressed, EXA1 once it is released
+            pressed = self.keys[self.v[x] & 0xF]
+            return not pressed if opcode & 0x00FF == 0x9E else pressed
+
+        # The delay timer poll, VX only holds the timer if the pass that just ran went through the FX07
+        if self.v[x] != self.delay_timer:
+            return False
+        skip = self.memory[address + 2] << 8 | self.memory[address + 3]
+        matches = self.delay_timer == skip & 0x00FF
+        return not matches if skip >> 12 == 0x3 else matches
+
+    # Function to run one instruction, an idle loop or FX0A wait is handled like at the end of any batch
     def run(self):
-        opcode = self.fetch_opcode()
-        self.execute_opcode(opcode)
+        self.run_cycles(1)
 
-        # Handle timers
+    # Function to count the timers down, called once per 60Hz frame
+    def tick_timers(self):
         if self.delay_timer > 0:
             self.delay_timer -= 1
         if self.sound_timer > 0:
             self.sound_timer -= 1
+
+    # Run n instructions back to back and return the packed framebuffer rows, timers are left to tick_timers
+    def run_cycles(self, n):
+        end = self.cycles + n
+        while self.cycles < end:
+            # Compiled blocks skip per-instruction hooks, so while tracing or profiling has swapped
+            # in its own step function the run stays on the interpreter
+            try:
+                if self.jit is not None and "step" not in self.__dict__:
+                    self.jit.run_cycles(end - self.cycles)
+                else:
+                    step = self.step
+                    for _ in range(end - self.cycles):
+                        step()
+            except WaitForKey:
+                # FX0A is waiting, nothing else runs until a key is pressed
+                break
+            except IdleLoop as idle:
+                # Timer ticks and key events only happen between batches, so the rest of this batch
+                # would just go around the loop, skip the whole passes and run what is left over
+                remaining = end - self.cycles
+                skipped = remaining - remaining % idle.period
+                self.cycles += skipped
+                self.idle_cycles += skipped
+
+        return self.display.rows
@@ -0,0 +1,292 @@
+# debugger.py
+
+import argparse
+import cmd
+import sys
+from cpu import CPU, IdleLoop, MEMORY_SIZE
+from quirks import QUIRK_PROFILES, detect_profile
+from scheduler import DEFAULT_INSTRUCTIONS_PER_FRAME
+from tracer import disassemble
+
+
+# Raised out of run_cycles by the debugger's step function when execution should stop
+class DebugBreak(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# Function to find the memory an instruction reads as (address, length), or None if it reads none
+# Opcode fetches don't count as reads
+def memory_reads(opcode, i):
+    if opcode & 0xF000 == 0xD000:
+        n = opcode & 0x000F
+        return i, n if n else 32
+    if opcode & 0xF0FF == 0xF065:
+        return i, ((opcode & 0x0F00) >> 8) + 1
+    return None
+
+
+# Breakpoints and memory watchpoints, checked by a step function swapped into the CPU only while attached
+# Detached, the CPU runs its own step, and the JIT, with nothing to check
+class Debugger:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.attached = False
+        self.next_step = None  # Step function debug_step wraps, set by CPU.add_step_hook
+        self.breakpoints = set()  # PC addresses that stop execution before the instruction runs
+        self.watchpoints = []  # (start, end, access) with access "r", "w" or "rw", end exclusive
+        self.hits = []  # Watchpoint hits since the last stop
+        self.resume_pc = None  # A breakpoint here is passed once, so execution can continue from it
+
+    # Function to start checking, swaps in debug_step and the write hook
+    def attach(self):
+        if self.attached:
+            return
+        self.cpu.add_step_hook(self, self.debug_step)
+        # Every memory write, from FX33, FX55, write_memory or a loaded program, goes through invalidate_code
+        self.cpu.invalidate_code = self.watched_invalidate
+        self.attached = True
+
+    # Function to stop checking and take debug_step and the write hook out of the CPU
+    def detach(self):
+        if not self.attached:
+            return
+        self.cpu.remove_step_hook(self)
+        del self.cpu.invalidate_code
+        self.attached = False
+
+    # Function to add a watchpoint on length bytes starting at address
+    def watch(self, address, length=1, access="w"):
+        self.watchpoints.append((address, min(address + length, MEMORY_SIZE), access))
+
+    # Function to remove the watchpoints starting at address
+    def unwatch(self, address):
+        self.watchpoints = [watchpoint for watchpoint in self.watchpoints if watchpoint[0] != address]
+
+    # Function to log a hit for every watchpoint of the given access overlapping address..address+length
+    def check_watchpoints(self, address, length, access):
+        end = address + length
+        for start, watch_end, watched in self.watchpoints:
+            if access in watched and address < watch_end and start < end:
+                kind = "read" if access == "r" else "write"
+                self.hits.append(f"{kind} of {address:03X}-{end - 1:03X} hit watchpoint {start:03X}-{watch_end - 1:03X}")
+
+    # Function to check writes against the watchpoints, swapped in for invalidate_code while attached
+    def watched_invalidate(self, address, length=1):
+        CPU.invalidate_code(self.cpu, address, length)
+        if self.watchpoints:
+            self.check_watchpoints(address, length, "w")
+
+    # Function to check the breakpoints, run one instruction and then check the watchpoints it hit
+    def debug_step(self):
+        cpu = self.cpu
+        pc = cpu.pc
+        if pc in self.breakpoints and pc != self.resume_pc:
+            raise DebugBreak(f"breakpoint at {pc:03X}")
+        self.resume_pc = None
+
+        if self.watchpoints:
+            reads = memory_reads(cpu.memory[pc] << 8 | cpu.memory[pc + 1], cpu.i)
+            if reads is not None:
+                self.check_watchpoints(*reads, "r")
+        try:
+            self.next_step()
+        except IdleLoop:
+            # The instruction already ran, the loop goes around one instruction at a time so breakpoints
+            # inside it still stop it
+            pass
+
+        if self.hits:
+            reason = "; ".join(self.hits)
+            self.hits = []
+            raise DebugBreak(reason)
+
+    # Function to run up to n instructions, returns why execution stopped early or None
+    def run(self, n):
+        cpu = self.cpu
+        end = cpu.cycles + n
+        self.resume_pc = cpu.pc
+        try:
+            cpu.run_cycles(n)
+        except DebugBreak as stop:
+            return stop.reason
+        if cpu.cycles < end:
+            return "waiting for a key press"
+        return None
+
+
+# Interactive shell around a Debugger, addresses and values are in hex
+class DebuggerShell(cmd.Cmd):
+    prompt = "(chip8) "
+
+    def __init__(self, debugger, instructions_per_frame=DEFAULT_INSTRUCTIONS_PER_FRAME):
+        super().__init__()
+        self.debugger = debugger
+        self.cpu = debugger.cpu
+        self.instructions_per_frame = instructions_per_frame
+        self.frame_cycles = 0  # Instructions run since the last timer tick
+
+    def preloop(self):
+        self.debugger.attach()
+        self.show_location()
+
+    def postloop(self):
+        self.debugger.detach()
+
+    # Function to print the instruction at PC
+    def show_location(self):
+        pc = self.cpu.pc
+        opcode = self.cpu.memory[pc] << 8 | self.cpu.memory[pc + 1]
+        print(f"{pc:03X}: {opcode:04X}  {disassemble(opcode)}")
+
+    # Function to run n instructions, ticking the timers every instructions_per_frame, and report why it stopped
+    def execute(self, n):
+        reason = None
+        while n > 0 and reason is None:
+            count = min(n, self.instructions_per_frame - self.frame_cycles)
+            start = self.cpu.cycles
+            reason = self.debugger.run(count)
+            ran = self.cpu.cycles - start
+            n -= ran
+            self.frame_cycles += ran
+            if self.frame_cycles >= self.instructions_per_frame:
+                self.cpu.tick_timers()
+                self.frame_cycles = 0
+        if reason is not None:
+            print(f"Stopped: {reason}")
+        self.show_location()
+
+    def emptyline(self):
+        pass
+
+    def do_step(self, arg):
+        """step [N]: run one or N instructions"""
+        self.execute(int(arg) if arg else 1)
+
+    def do_continue(self, arg):
+        """continue [N]: run until a breakpoint or watchpoint hits, at most N instructions (default 1000000)"""
+        self.execute(int(arg) if arg else 1000000)
+
+    def do_break(self, arg):
+        """break [ADDR]: set a breakpoint at ADDR, without one list the breakpoints"""
+        if arg:
+            self.debugger.breakpoints.add(int(arg, 16))
+        for address in sorted(self.debugger.breakpoints):
+            print(f"breakpoint {address:03X}")
+
+    def do_delete(self, arg):
+        """delete ADDR: remove the breakpoint at ADDR"""
+        self.debugger.breakpoints.discard(int(arg, 16))
+
+    def do_watch(self, arg):
+        """watch [ADDR [LENGTH [r|w|rw]]]: stop after an instruction reads or writes memory, default 1 byte, w"""
+        args = arg.split()
+        if args:
+            access = args[2] if len(args) > 2 else "w"
+            if access not in ("r", "w", "rw"):
+                print("Access must be r, w or rw")
+                return
+            self.debugger.watch(int(args[0], 16), int(args[1], 16) if len(args) > 1 else 1, access)
+        for start, end, access in self.debugger.watchpoints:
+            print(f"watchpoint {start:03X}-{end - 1:03X} {access}")
+
+    def do_unwatch(self, arg):
+        """unwatch ADDR: remove the watchpoints starting at ADDR"""
+        self.debugger.unwatch(int(arg, 16))
+
+    def do_regs(self, arg):
+        """regs: show the registers, timers and stack"""
+        cpu = self.cpu
+        print(" ".join(f"V{index:X}={value:02X}" for index, value in enumerate(cpu.v)))
+        print(f"PC={cpu.pc:03X} I={cpu.i:03X} SP={cpu.sp} DT={cpu.delay_timer:02X} ST={cpu.sound_timer:02X} "
+              f"cycles={cpu.cycles}")
+        print("stack: " + " ".join(f"{address:03X}" for address in cpu.stack))
+
+    def do_set(self, arg):
+        """set REG VALUE: set V0-VF, I, PC, DT or ST"""
+        try:
+            register, value = arg.upper().split()
+            value = int(value, 16)
+        except ValueError:
+            print("Usage: set REG VALUE")
+            return
+        cpu = self.cpu
+        if len(register) == 2 and register[0] == "V":
+            cpu.v[int(register[1], 16)] = value & 0xFF
+        elif register in ("I", "PC", "DT", "ST"):
+            name = {"I": "i", "PC": "pc", "DT": "delay_timer", "ST": "sound_timer"}[register]
+            setattr(cpu, name, value)
+        else:
+            print(f"Unknown register {register}")
+
+    def do_mem(self, arg):
+        """mem ADDR [LENGTH]: dump memory, 16 bytes per line"""
+        args = arg.split()
+        address = int(args[0], 16) if args else self.cpu.i
+        length = int(args[1], 16) if len(args) > 1 else 0x40
+        data = self.cpu.memory[address:address + length]
+        for offset in range(0, len(data), 16):
+            print(f"{address + offset:03X}: " + " ".join(f"{byte:02X}" for byte in data[offset:offset + 16]))
+
+    def do_list(self, arg):
+        """list [ADDR [COUNT]]: disassemble COUNT instructions from ADDR, default 8 from PC"""
+        args = arg.split()
+        address = int(args[0], 16) if args else self.cpu.pc
+        for _ in range(int(args[1]) if len(args) > 1 else 8):
+            if address + 1 >= MEMORY_SIZE:
+                break
+            opcode = self.cpu.memory[address] << 8 | self.cpu.memory[address + 1]
+            marker = "*" if address in self.debugger.breakpoints else " "
+            print(f"{marker}{address:03X}: {opcode:04X}  {disassemble(opcode)}")
+            address += 2
+
+    def do_screen(self, arg):
+        """screen: print the framebuffer"""
+        display = self.cpu.display
+        for row in display.rows:
+            print(format(row, f"0{display.width}b").replace("0", ".").replace("1", "#"))
+
+    def do_key(self, arg):
+        """key K down|up: press or release keypad key K"""
+        try:
+            key, state = arg.split()
+            key = int(key, 16) & 0xF
+        except ValueError:
+            print("Usage: key K down|up")
+            return
+        if state == "down":
+            self.cpu.keyboard.press(key)
+        else:
+            self.cpu.keyboard.release(key)
+
+    def do_quit(self, arg):
+        """quit: leave the debugger"""
+        return True
+
+    do_s = do_step
+    do_c = do_continue
+    do_b = do_break
+    do_q = do_quit
+    do_EOF = do_quit
+
+
+# Debug a ROM headless from an interactive prompt
+def main(argv):
+    parser = argparse.ArgumentParser(description="Debug a Chip-8 ROM with breakpoints and watchpoints")
+    parser.add_argument("rom", help="path to a Chip-8 ROM")
+    parser.add_argument("--ipf", type=int, default=DEFAULT_INSTRUCTIONS_PER_FRAME,
+                        help="instructions per 60Hz timer tick")
+    parser.add_argument("--quirks", choices=sorted(QUIRK_PROFILES), help="quirk profile, detected from the ROM by default")
+    parser.add_argument("--seed", type=int, help="seed for the CXKK random number generator")
+    args = parser.parse_args(argv)
+
+    with open(args.rom, "rb") as rom_file:
+        profile = args.quirks or detect_profile(rom_file.read())
+    cpu = CPU(seed=args.seed, quirks=profile)
+    cpu.load_rom(args.rom)
+    DebuggerShell(Debugger(cpu), args.ipf).cmdloop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
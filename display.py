@@ -3,12 +3,161 @@ import curses
 from globals import status_items
 
 
-class Display:
-    def __init__(self, stdscr):
+# Translation from a row's binary digits to the characters drawn for it
+PIXEL_CHARS = str.maketrans("01", " █")
+
+# Characters for a (top pixel, bottom pixel) pair in half-block mode
+HALF_BLOCK_CHARS = {("0", "0"): " ", ("1", "0"): "▀", ("0", "1"): "▄", ("1", "1"): "█"}
+
+
+# Screen sizes, SCHIP programs can switch to the high resolution one
+LOW_RES_WIDTH = 64
+LOW_RES_HEIGHT = 32
+HIGH_RES_WIDTH = 128
+HIGH_RES_HEIGHT = 64
+
+
+# Headless display backend, keeps the framebuffer in memory and never touches a terminal
+class HeadlessDisplay:
+    def __init__(self):
+        self.stdscr = None
+        self.width = LOW_RES_WIDTH
+        self.height = LOW_RES_HEIGHT
+        self.row_mask = (1 << self.width) - 1
+
+        # Framebuffer, one packed integer per row, the leftmost pixel is the most significant bit
+        self.rows = [0] * self.height
+
+        # Frame sinks (see frames.py), each gets write(display) once per finished frame
+        self.sinks = []
+
+    # Unpacked view of the framebuffer as a list of rows of 0/1 pixels
+    @property
+    def screen(self):
+        return [[(row >> (self.width - 1 - x)) & 1 for x in range(self.width)] for row in self.rows]
+
+    def clear(self):
+        self.rows[:] = [0] * self.height
+
+    def set_resolution(self, width, height):
+        # Switching resolution clears the screen
+        self.width = width
+        self.height = height
+        self.row_mask = (1 << width) - 1
+        self.rows[:] = [0] * height
+
+    # Scrolling shifts whole rows, or every row's bits, never single pixels
+
+    def scroll_down(self, n):
+        n = min(n, self.height)
+        self.rows[:] = [0] * n + self.rows[:self.height - n]
+
+    def scroll_up(self, n):
+        n = min(n, self.height)
+        self.rows[:] = self.rows[n:] + [0] * n
+
+    def scroll_right(self, n):
+        self.rows[:] = [row >> n for row in self.rows]
+
+    def scroll_left(self, n):
+        row_mask = self.row_mask
+        self.rows[:] = [(row << n) & row_mask for row in self.rows]
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def publish(self):
+        # Hand the finished frame to every sink
+        for sink in self.sinks:
+            sink.write(self)
+
+    def draw_pixel(self, x, y):
+        # Wrap around the screen if the coordinates are out of bounds
+        x %= self.width
+        y %= self.height
+
+        # Toggle the pixel state
+        self.rows[y] ^= 1 << (self.width - 1 - x)
+
+    def draw_sprite(self, x, y, sprite, sprite_width=8):
+        # Draw a sprite at the specified coordinates x,y, each sprite row is XORed into its screen row
+        # Sprites are 8 pixels wide, one byte per row, or 16 wide for SCHIP's DXY0 with one integer per row
+        width = self.width
+        height = self.height
+        rows = self.rows
+        collision = 0
+
+        # Shift that lines the sprite's leftmost bit up with column x, negative when the sprite wraps
+        shift = width - sprite_width - (x % width)
+
+        for byte_index in range(len(sprite)):
+            sprite_byte = sprite[byte_index]
+            if not sprite_byte:
+                continue
+            if shift >= 0:
+                bits = sprite_byte << shift
+            else:
+                # Rotate the bits that run off the right edge back in on the left
+                bits = (sprite_byte >> -shift) | ((sprite_byte << (width + shift)) & self.row_mask)
+
+            row = (y + byte_index) % height
+            if rows[row] & bits:
+                collision = 1
+            rows[row] ^= bits
+        return collision
+
+    def draw_clipped_sprite(self, x, y, sprite, sprite_width=8):
+        # Like draw_sprite, but the parts of the sprite past the right and bottom edges are cut off
+        # The sprite's position still wraps onto the screen
+        x %= self.width
+        y %= self.height
+        rows = self.rows
+        collision = 0
+
+        shift = self.width - sprite_width - x
+        for byte_index in range(min(len(sprite), self.height - y)):
+            sprite_byte = sprite[byte_index]
+            if not sprite_byte:
+                continue
+            bits = sprite_byte << shift if shift >= 0 else sprite_byte >> -shift
+
+            row = y + byte_index
+            if rows[row] & bits:
+                collision = 1
+            rows[row] ^= bits
+        return collision
+
+    def set_sprite_clipping(self, clip):
+        # Clipping swaps in draw_clipped_sprite as draw_sprite, so drawing never checks a flag
+        if clip:
+            self.draw_sprite = self.draw_clipped_sprite
+        else:
+            self.__dict__.pop("draw_sprite", None)
+
+    def display_status_line(self, items=None):
+        # Nothing to draw without a terminal
+        pass
+
+    def refresh(self):
+        # Nothing to draw without a terminal
+        pass
+
+
+# Curses display backend, draws only what changed since the last presented frame
+class Display(HeadlessDisplay):
+    def __init__(self, stdscr, half_block=False):
+        super().__init__()
         self.stdscr = stdscr
-        self.width = 64
-        self.height = 32
-        self.screen = [[0] * self.width for _ in range(self.height)]
+
+        # Half-block mode packs two Chip-8 rows into each terminal row with ▀/▄
+        self.half_block = half_block
+
+        # Rows as they are on the terminal right now
+        self.presented = [0] * self.height
+        self.presented_size = (self.width, self.height)
 
         # Initialize ncurses window
         self.initialize_screen()
@@ -20,40 +169,51 @@ class Display:
         curses.curs_set(0)
         # Non-blocking input
         self.stdscr.nodelay(True)
-        # Set getch timeout to 1ms
-        self.stdscr.timeout(1)
+        # Don't wait in getch, the scheduler sleeps between frames
+        self.stdscr.timeout(0)
 
-    def clear(self):
-        self.screen = [[0] * self.width for _ in range(self.height)]
-        self.stdscr.clear()
+    def present(self, rows, width=None):
+        # Rows come from this display unless the threaded presenter passes another display's frame and width
+        if width is None:
+            width = self.width
+        height = len(rows)
 
-    def draw_pixel(self, x, y):
-        # Wrap around the screen if the coordinates are out of bounds
-        x %= self.width
-        y %= self.height
+        # After a resolution switch start again from a blank terminal
+        if (width, height) != self.presented_size:
+            self.presented_size = (width, height)
+            self.presented = [0] * height
+            self.stdscr.clear()
 
-        # Toggle the pixel state
-        self.screen[y][x] ^= 1
+        # Draw the rows that differ from what is on the terminal, only the changed span of each
+        presented = self.presented
+        step = 2 if self.half_block else 1
+        for y in range(0, height, step):
+            changed = rows[y] ^ presented[y]
+            if self.half_block:
+                changed |= rows[y + 1] ^ presented[y + 1]
+            if not changed:
+                continue
 
-        # Draw the pixel to the ncurses screen
-        if self.screen[y][x] == 1:
-            self.stdscr.addch(y, x, "█")  # Draw a filled block
-        else:
-            self.stdscr.addch(y, x, " ")  # Draw an empty block
+            # Columns of the leftmost and rightmost changed pixels
+            start = width - changed.bit_length()
+            end = width - ((changed & -changed).bit_length() - 1)
 
-    def draw_sprite(self, x, y, sprite):
-        # Draw an 8-bit sprite at the specified coordinates x,y
-        collision = 0
-        for byte_index in range(len(sprite)):
-            sprite_byte = sprite[byte_index]
-            for bit_index in range(8):
-                if sprite_byte & (0x80 >> bit_index):
-                    if self.screen[(y + byte_index) % self.height][(x + bit_index) % self.width] == 1:
-                        collision = 1
-                    self.draw_pixel(x + bit_index, y + byte_index)
-        return collision
+            if self.half_block:
+                top = format(rows[y], f"0{width}b")
+                bottom = format(rows[y + 1], f"0{width}b")
+                text = "".join(HALF_BLOCK_CHARS[pair] for pair in zip(top[start:end], bottom[start:end]))
+                self.stdscr.addstr(y // 2, start, text)
+            else:
+                text = format(rows[y], f"0{width}b")[start:end].translate(PIXEL_CHARS)
+                self.stdscr.addstr(y, start, text)
+
+        presented[:] = rows
+
+    def display_status_line(self, items=None):
+        # Items default to the global status items, the threaded presenter passes a copy made with its frame
+        if items is None:
+            items = status_items
 
-    def display_status_line(self):
         # Get the screen dimensions
         height, width = self.stdscr.getmaxyx()
 
@@ -63,14 +223,16 @@ class Display:
 
         # Create a single string from the status items
         status_str = " | ".join(
-            f"{key}: {value}" for key, value in status_items.items())
+            f"{key}: {value}" for key, value in items.items())
 
-        # Ensure the string is not longer than the screen width
-        if len(status_str) > width:
+        # Keep the string off the last column, curses fails writing to the bottom-right cell
+        if len(status_str) >= width:
             status_str = status_str[:width - 1]
 
         # Add the status string to the bottom of the screen
         self.stdscr.addstr(height - 1, 0, status_str, curses.A_REVERSE)
 
     def refresh(self):
+        # Flush the frame to the terminal once
+        self.present(self.rows)
         self.stdscr.refresh()
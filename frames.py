@@ -0,0 +1,236 @@
+# frames.py
+
+import argparse
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+from multiprocessing import shared_memory
+from display import HIGH_RES_WIDTH, HIGH_RES_HEIGHT
+from globals import log_debug
+
+# Shared framebuffer header: frames published so far, width, height, PID of the process writing it,
+# the packed rows follow
+SHARED_HEADER_FORMAT = struct.Struct("<IHHI")
+
+# Frame stream header: magic, format version, the records after it are one zlib stream
+STREAM_MAGIC = b"C8FS"
+STREAM_VERSION = 1
+STREAM_HEADER_FORMAT = struct.Struct("<4sH")
+
+# Frame stream records, each starts with its kind byte
+SIZE_RECORD = 0x00  # Width and height, the previous frame is blank again after one
+REPEAT_RECORD = 0x01  # The previous frame is shown this many more times
+DELTA_RECORD = 0x02  # Bitmask of the rows that changed, then each changed row XORed with its previous value
+SIZE_FORMAT = struct.Struct("<HH")
+REPEAT_FORMAT = struct.Struct("<I")
+
+
+# Function to pack framebuffer rows into bytes, leftmost pixel in the most significant bit
+def pack_rows(rows, width):
+    row_bytes = width // 8
+    return b"".join(row.to_bytes(row_bytes, "big") for row in rows)
+
+
+# Function to write one frame as a binary PBM image
+def write_pbm(path, rows, width):
+    with open(path, "wb") as image:
+        image.write(f"P4\n{width} {len(rows)}\n".encode() + pack_rows(rows, width))
+
+
+# Function to check whether a process is still running
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, under another user
+        return True
+    return True
+
+
+# Function to unlink a shared framebuffer left behind by a run that was killed before it could clean up
+# Raises FileExistsError if the process that wrote it is still running
+def replace_stale_block(name):
+    stale = shared_memory.SharedMemory(name=name)
+    try:
+        owner = SHARED_HEADER_FORMAT.unpack_from(stale.buf)[3] if stale.size >= SHARED_HEADER_FORMAT.size else 0
+        if owner and process_alive(owner):
+            raise FileExistsError(f"Shared framebuffer {name} is in use by process {owner}")
+        log_debug("Replacing stale shared framebuffer %s", name)
+        stale.unlink()
+    finally:
+        stale.close()
+
+
+# Frame sink exporting the latest frame through a shared memory block other processes can map
+# In this process view is a zero-copy memoryview of the same block, sized for the SCHIP high resolution
+class SharedFramebuffer:
+    def __init__(self, name=None):
+        self.frame_bytes = HIGH_RES_WIDTH * HIGH_RES_HEIGHT // 8
+        size = SHARED_HEADER_FORMAT.size + self.frame_bytes
+        self.owner = os.getpid()
+        try:
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            replace_stale_block(name)
+            self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.memory.name
+        self.view = self.memory.buf
+        self.sequence = 0
+        SHARED_HEADER_FORMAT.pack_into(self.view, 0, self.sequence, 0, 0, self.owner)
+
+    # Function to copy a finished frame into the block, the sequence number is written last
+    def write(self, display):
+        data = pack_rows(display.rows, display.width)
+        self.view[SHARED_HEADER_FORMAT.size:SHARED_HEADER_FORMAT.size + len(data)] = data
+        self.sequence += 1
+        SHARED_HEADER_FORMAT.pack_into(self.view, 0, self.sequence, display.width, display.height, self.owner)
+
+    # Function to release and unlink the block, later calls do nothing
+    def close(self):
+        if self.memory is None:
+            return
+        self.view = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+
+# Frame sink recording every frame on a background thread, either as a delta-encoded frame stream
+# or as a directory of PBM images holding the frames that differ from the one before
+class FrameRecorder:
+    def __init__(self, path, image_format="stream"):
+        self.path = path
+        self.image_format = image_format  # "stream" or "pbm"
+        self.frames = queue.SimpleQueue()  # (width, height, rows) per frame, None once closed
+        self.frame_number = 0  # Frames written by the background thread
+        self.thread = threading.Thread(target=self.encode, name="chip8-frame-recorder", daemon=True)
+
+        if image_format == "pbm":
+            os.makedirs(path, exist_ok=True)
+            self.stream = None
+        else:
+            self.stream = open(path, "wb")
+            self.stream.write(STREAM_HEADER_FORMAT.pack(STREAM_MAGIC, STREAM_VERSION))
+            self.compressor = zlib.compressobj(9)
+        self.thread.start()
+
+    # Function to queue a finished frame, the rows are copied so the CPU can keep drawing
+    def write(self, display):
+        self.frames.put((display.width, display.height, tuple(display.rows)))
+
+    # Background thread, encodes frames until close
+    def encode(self):
+        size = None
+        previous = None
+        repeats = 0
+        while True:
+            frame = self.frames.get()
+            if frame is None:
+                break
+            width, height, rows = frame
+
+            if self.stream is None:
+                if rows != previous:
+                    write_pbm(os.path.join(self.path, f"frame_{self.frame_number:06d}.pbm"), rows, width)
+            else:
+                if rows == previous and (width, height) == size:
+                    repeats += 1
+                else:
+                    if repeats:
+                        self.emit(bytes([REPEAT_RECORD]) + REPEAT_FORMAT.pack(repeats))
+                        repeats = 0
+                    if (width, height) != size:
+                        size = (width, height)
+                        previous = (0,) * height
+                        self.emit(bytes([SIZE_RECORD]) + SIZE_FORMAT.pack(width, height))
+                    self.emit(self.encode_delta(previous, rows, width))
+
+            previous = rows
+            self.frame_number += 1
+
+        if self.stream is not None:
+            if repeats:
+                self.emit(bytes([REPEAT_RECORD]) + REPEAT_FORMAT.pack(repeats))
+            self.stream.write(self.compressor.flush())
+            self.stream.close()
+
+    # Function to encode a frame as the rows that changed since the previous one
+    def encode_delta(self, previous, rows, width):
+        changed = 0
+        deltas = []
+        for y, row in enumerate(rows):
+            delta = row ^ previous[y]
+            if delta:
+                changed |= 1 << y
+                deltas.append(delta)
+        return bytes([DELTA_RECORD]) + changed.to_bytes(len(rows) // 8, "little") + pack_rows(deltas, width)
+
+    def emit(self, record):
+        self.stream.write(self.compressor.compress(record))
+
+    # Function to finish writing the queued frames and stop the background thread
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+
+
+# Function to read a frame stream written by FrameRecorder, yields (width, height, rows) for every frame
+def read_frame_stream(path):
+    with open(path, "rb") as stream:
+        blob = stream.read()
+    magic, version = STREAM_HEADER_FORMAT.unpack_from(blob)
+    if magic != STREAM_MAGIC or version != STREAM_VERSION:
+        raise ValueError(f"{path} isn't a version {STREAM_VERSION} Chip-8 frame stream")
+    data = zlib.decompress(blob[STREAM_HEADER_FORMAT.size:])
+
+    offset = 0
+    width = height = 0
+    rows = []
+    while offset < len(data):
+        kind = data[offset]
+        offset += 1
+        if kind == SIZE_RECORD:
+            width, height = SIZE_FORMAT.unpack_from(data, offset)
+            offset += SIZE_FORMAT.size
+            rows = [0] * height
+        elif kind == REPEAT_RECORD:
+            repeats, = REPEAT_FORMAT.unpack_from(data, offset)
+            offset += REPEAT_FORMAT.size
+            for _ in range(repeats):
+                yield width, height, rows[:]
+        elif kind == DELTA_RECORD:
+            mask_bytes = height // 8
+            changed = int.from_bytes(data[offset:offset + mask_bytes], "little")
+            offset += mask_bytes
+            row_bytes = width // 8
+            for y in range(height):
+                if changed >> y & 1:
+                    rows[y] ^= int.from_bytes(data[offset:offset + row_bytes], "big")
+                    offset += row_bytes
+            yield width, height, rows[:]
+        else:
+            raise ValueError(f"{path}: unknown record kind {kind} at offset {offset - 1}")
+
+
+# Convert a frame stream into a directory of PBM images, one per frame
+def main(argv):
+    parser = argparse.ArgumentParser(description="Convert a Chip-8 frame stream into PBM images")
+    parser.add_argument("stream", help="frame stream written with main.py --capture")
+    parser.add_argument("directory", help="directory to write frame_NNNNNN.pbm files into")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.directory, exist_ok=True)
+    count = 0
+    for width, _, rows in read_frame_stream(args.stream):
+        write_pbm(os.path.join(args.directory, f"frame_{count:06d}.pbm"), rows, width)
+        count += 1
+    print(f"{count} frames written to {args.directory}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,4 +1,5 @@
 # globals.py
+import atexit
 import os
 import datetime
 
@@ -7,21 +8,38 @@ DEBUG_MODE = False  # Set to False to disable debug logging
 # Specify the log file path
 log_file_path = os.path.join(os.path.dirname(__file__), "chip8_debug.log")
 
+# Log file handle, opened on the first message and kept open
+log_file = None
 
-def log_debug(message):
+
+def log_debug(message, *args):
     """
     Logs a debug message to the log file with a timestamp.
 
-    :param message: The message to log
+    Nothing is formatted unless DEBUG_MODE is on, so pass values as
+    printf-style arguments instead of building an f-string.
+
+    :param message: The message to log, a printf-style format if args are given
+    :param args: Values substituted into the message
     """
+    global log_file
+
+    if not DEBUG_MODE:
+        return
+
+    if log_file is None:
+        # Open the log file in append mode, it is flushed and closed at exit
+        log_file = open(log_file_path, "a")
+        atexit.register(log_file.close)
+
     # Timestamp for the log entry
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    if DEBUG_MODE:
-        # Open the log file in append mode
-        with open(log_file_path, "a") as log_file:
-            # Write the message with the timestamp
-            log_file.write(f"[{timestamp}] {message}\n")
+    if args:
+        message = message % args
+
+    # Write the message with the timestamp
+    log_file.write(f"[{timestamp}] {message}\n")
 
 
 # Global dictionary to hold status items
@@ -30,4 +48,5 @@ status_items = {
     "rom": "No ROM loaded",  # Initial ROM status
     "error": "",  # Initial error status
     "opcode": "",  # Initial opcode status
+    "overruns": "0",  # Frames that missed their deadline
 }
@@ -1,3 +1,105 @@
 # input.py
 
-# TODO: Implement input handling module
\ No newline at end of file
+import collections
+import time
+
+# Host keys mapped onto the Chip-8 hex keypad
+#   1 2 3 4      1 2 3 C
+#   q w e r  ->  4 5 6 D
+#   a s d f      7 8 9 E
+#   z x c v      A 0 B F
+KEY_MAP = {
+    ord('1'): 0x1, ord('2'): 0x2, ord('3'): 0x3, ord('4'): 0xC,
+    ord('q'): 0x4, ord('w'): 0x5, ord('e'): 0x6, ord('r'): 0xD,
+    ord('a'): 0x7, ord('s'): 0x8, ord('d'): 0x9, ord('f'): 0xE,
+    ord('z'): 0xA, ord('x'): 0x0, ord('c'): 0xB, ord('v'): 0xF,
+}
+
+# Host key that quits, kept off the keypad so every keypad key can be pressed
+QUIT_KEY = 27  # Esc
+
+# Terminals only report key presses, so a key counts as held this long after its last press (or auto-repeat)
+DEFAULT_HOLD_TIME = 0.2
+
+# Key presses kept for FX0A, older ones are dropped once this many are queued
+MAX_QUEUED_PRESSES = 16
+
+
+# Raised by FX0A when no key press is queued, ends the current instruction batch
+class WaitForKey(Exception):
+    pass
+
+
+# Function to read every pending host key code from curses without waiting
+def read_host_keys(stdscr):
+    host_keys = []
+    while True:
+        key = stdscr.getch()
+        if key == -1:
+            return host_keys
+        host_keys.append(key)
+
+
+# Keyboard state for the Chip-8 keypad, with a queue of key presses for FX0A
+class Keyboard:
+    def __init__(self, keys, clock, hold_time=DEFAULT_HOLD_TIME):
+        self.keys = keys  # The CPU's key state list, updated in place and read by EX9E/EXA1
+        self.clock = clock  # Returns the CPU cycle count, presses are stamped with it
+        self.hold_time = hold_time
+        self.release_at = [0.0] * 16  # When each held key is released
+        self.presses = collections.deque(maxlen=MAX_QUEUED_PRESSES)  # (key, cycle) presses not yet taken
+        self.recorder = None  # Optional InputRecorder that logs every key change
+
+    # Function to press a key, held keys just have their hold time extended
+    def press(self, key, now=None):
+        if now is None:
+            now = time.monotonic()
+        if not self.keys[key]:
+            self.keys[key] = 1
+            self.presses.append((key, self.clock()))
+            if self.recorder is not None:
+                self.recorder.key(key, True)
+        self.release_at[key] = now + self.hold_time
+
+    # Function to release a key
+    def release(self, key):
+        if self.keys[key]:
+            self.keys[key] = 0
+            if self.recorder is not None:
+                self.recorder.key(key, False)
+
+    # Function to release the keys whose hold time ran out
+    def update(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        for key in range(16):
+            if self.keys[key] and now >= self.release_at[key]:
+                self.release(key)
+
+    # Function to read every pending key from curses
+    # Returns the host keys that aren't on the keypad, plus any reserved keys, which are never mapped
+    def poll(self, stdscr, reserved=()):
+        return self.feed(read_host_keys(stdscr), reserved)
+
+    # Function to press the keypad keys among host key codes read elsewhere, and release the expired ones
+    # Returns the host keys that aren't on the keypad, plus any reserved keys, which are never mapped
+    def feed(self, host_keys, reserved=()):
+        now = time.monotonic()
+        other_keys = []
+        for key in host_keys:
+            chip8_key = KEY_MAP.get(key)
+            if chip8_key is None or key in reserved:
+                other_keys.append(key)
+            else:
+                self.press(chip8_key, now)
+        self.update(now)
+        return other_keys
+
+    # Function to take the oldest key press made at or after cycle for FX0A, or None if there isn't one
+    # Presses from before the wait started are dropped, a key pressed and released earlier doesn't end it
+    def next_press(self, cycle):
+        while self.presses:
+            key, pressed_at = self.presses.popleft()
+            if pressed_at >= cycle:
+                return key
+        return None
@@ -0,0 +1,263 @@
+# jit.py
+
+import re
+from cpu import MEMORY_SIZE, FONT_START, idle_loop_period
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE
+
+# Longest run of instructions compiled into a single block
+MAX_BLOCK_LENGTH = 64
+
+# Opcodes that end a basic block, the generated code sets PC itself for these
+TERMINATORS = ("00EE", "1NNN", "2NNN", "3XKK", "4XKK", "5XY0", "9XY0", "BNNN", "FX33", "FX55")
+
+# Patterns to find which registers and whether I are used by generated code
+REGISTER_PATTERN = re.compile(r"\bv([0-9a-f])\b")
+REGISTER_WRITE_PATTERN = re.compile(r"^v([0-9a-f]) (?:=|\|=|&=|\^=|>>=) ", re.MULTILINE)
+INDEX_PATTERN = re.compile(r"\bi\b")
+
+
+# Function to name the opcode pattern a block compiler understands, or None if it is left to the interpreter
+def opcode_pattern(opcode):
+    first_nibble = (opcode & 0xF000) >> 12
+    last_nibble = opcode & 0x000F
+    last_byte = opcode & 0x00FF
+
+    if opcode == 0x00E0:
+        return "00E0"
+    if opcode == 0x00EE:
+        return "00EE"
+    if first_nibble in (0x1, 0x2, 0xA, 0xB):
+        return f"{first_nibble:X}NNN"
+    if first_nibble in (0x3, 0x4, 0x6, 0x7, 0xC):
+        return f"{first_nibble:X}XKK"
+    if first_nibble in (0x5, 0x9) and last_nibble == 0x0:
+        return f"{first_nibble:X}XY0"
+    if first_nibble == 0x8 and last_nibble in (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE):
+        return f"8XY{last_nibble:X}"
+    if first_nibble == 0xD and last_nibble != 0x0:
+        return "DXYN"
+    if first_nibble == 0xF and last_byte in (0x07, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65):
+        return f"FX{last_byte:02X}"
+    # EX9E/EXA1, FX0A, the SCHIP opcodes and unknown opcodes always go through the interpreter
+    return None
+
+
+# Function to generate the Python statements for one instruction
+# The quirk flags pick the variant to generate, as the CPU's handler overrides do for the interpreter
+def generate_instruction(pattern, opcode, address, quirks=QUIRK_PROFILES[DEFAULT_PROFILE]):
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    n = opcode & 0x000F
+    kk = opcode & 0x00FF
+    nnn = opcode & 0x0FFF
+    vx = f"v{x:x}"
+    vy = f"v{y:x}"
+    next_pc = address + 2
+
+    if pattern == "00E0":
+        return ["cpu.clear_screen()"]
+    if pattern == "00EE":
+        return ["cpu.pc = cpu.stack.pop()", "cpu.sp -= 1"]
+    if pattern == "1NNN":
+        return [f"cpu.pc = {nnn}"]
+    if pattern == "2NNN":
+        return [f"cpu.stack.append({next_pc})", "cpu.sp += 1", f"cpu.pc = {nnn}"]
+    if pattern == "3XKK":
+        return [f"cpu.pc = {next_pc + 2} if {vx} == {kk} else {next_pc}"]
+    if pattern == "4XKK":
+        return [f"cpu.pc = {next_pc + 2} if {vx} != {kk} else {next_pc}"]
+    if pattern == "5XY0":
+        return [f"cpu.pc = {next_pc + 2} if {vx} == {vy} else {next_pc}"]
+    if pattern == "6XKK":
+        return [f"{vx} = {kk}"]
+    if pattern == "7XKK":
+        return [f"{vx} = ({vx} + {kk}) & 0xFF"]
+    if pattern == "8XY0":
+        return [f"{vx} = {vy}"]
+    if pattern in ("8XY1", "8XY2", "8XY3"):
+        operator = {"8XY1": "|", "8XY2": "&", "8XY3": "^"}[pattern]
+        return [f"{vx} {operator}= {vy}"] + (["vf = 0"] if quirks["vf_reset"] else [])
+    if pattern == "8XY4":
+        return [f"result = {vx} + {vy}", "vf = result >> 8", f"{vx} = result & 0xFF"]
+    if pattern == "8XY5":
+        return [f"result = ({vx} - {vy}) & 0xFF", f"vf = 1 if {vx} >= {vy} else 0", f"{vx} = result"]
+    if pattern == "8XY6":
+        if quirks["shift_vy"]:
+            return [f"result = {vy}", "vf = result & 0x1", f"{vx} = result >> 1"]
+        return [f"vf = {vx} & 0x1", f"{vx} >>= 1"]
+    if pattern == "8XY7":
+        return [f"result = ({vy} - {vx}) & 0xFF", f"vf = 1 if {vy} >= {vx} else 0", f"{vx} = result"]
+    if pattern == "8XYE":
+        if quirks["shift_vy"]:
+            return [f"result = {vy}", "vf = (result & 0x80) >> 7", f"{vx} = (result << 1) & 0xFF"]
+        return [f"vf = ({vx} & 0x80) >> 7", f"{vx} = ({vx} << 1) & 0xFF"]
+    if pattern == "9XY0":
+        return [f"cpu.pc = {next_pc + 2} if {vx} != {vy} else {next_pc}"]
+    if pattern == "ANNN":
+        return [f"i = {nnn}"]
+    if pattern == "BNNN":
+        return [f"cpu.pc = {nnn} + {vx if quirks['jump_vx'] else 'v0'}"]
+    if pattern == "CXKK":
+        return [f"{vx} = cpu.random_byte() & {kk}"]
+    if pattern == "DXYN":
+        return [f"vf = cpu.display.draw_sprite({vx}, {vy}, memory[i:i + {n}])"]
+    if pattern == "FX07":
+        return [f"{vx} = cpu.delay_timer"]
+    if pattern == "FX15":
+        return [f"cpu.delay_timer = {vx}"]
+    if pattern == "FX18":
+        return [f"cpu.sound_timer = {vx}"]
+    if pattern == "FX1E":
+        return [f"i = (i + {vx}) & 0xFFFF"]
+    if pattern == "FX29":
+        return [f"i = {FONT_START} + {vx} * 5"]
+    if pattern == "FX33":
+        return [f"memory[i] = {vx} // 100",
+                f"memory[i + 1] = ({vx} // 10) % 10",
+                f"memory[i + 2] = {vx} % 10",
+                "cpu.invalidate_code(i, 3)",
+                f"cpu.pc = {next_pc}"]
+    if pattern in ("FX55", "FX65"):
+        increment = {None: [], "x+1": [f"i = (i + {x + 1}) & 0xFFFF"], "x": [f"i = (i + {x}) & 0xFFFF"]}
+        increment = increment[quirks["index_increment"]]
+        if pattern == "FX65":
+            return [f"v{r:x} = memory[i + {r}]" for r in range(x + 1)] + increment
+        lines = [f"memory[i + {r}] = v{r:x}" for r in range(x + 1)]
+        return lines + [f"cpu.invalidate_code(i, {x + 1})"] + increment + [f"cpu.pc = {next_pc}"]
+    raise ValueError(f"No code generator for opcode {opcode:04X}")
+
+
+# Function to generate the source of a block function starting at address, at most max_length instructions long
+# Returns (source, instruction count, end address), the source is None when the first instruction can't be compiled
+def generate_block(memory, start, name="block", quirks=QUIRK_PROFILES[DEFAULT_PROFILE], max_length=MAX_BLOCK_LENGTH):
+    body = []
+    count = 0
+    address = start
+    terminated = False
+
+    while count < max_length and address + 1 < MEMORY_SIZE:
+        opcode = memory[address] << 8 | memory[address + 1]
+        pattern = opcode_pattern(opcode)
+        if pattern is None:
+            break
+        # Jumps closing an idle loop stay on the interpreter, which skips the spinning
+        if pattern == "1NNN" and idle_loop_period(memory, opcode & 0x0FFF, address) is not None:
+            break
+        body.append(f"# {address:03X}: {opcode:04X}")
+        body.extend(generate_instruction(pattern, opcode, address, quirks))
+        count += 1
+        address += 2
+        if pattern in TERMINATORS:
+            terminated = True
+            break
+
+    if count == 0:
+        return None, 0, start
+
+    if not terminated:
+        body.append(f"cpu.pc = {address}")
+
+    # Registers and I are held in locals, loaded on entry and written back on exit
+    code = "\n".join(body)
+    registers = sorted({int(r, 16) for r in REGISTER_PATTERN.findall(code)})
+    written = sorted({int(r, 16) for r in REGISTER_WRITE_PATTERN.findall(code)})
+    uses_i = INDEX_PATTERN.search(code) is not None
+
+    lines = [f"def {name}(cpu):", "    v = cpu.v", "    memory = cpu.memory"]
+    lines += [f"    v{r:x} = v[{r}]" for r in registers]
+    if uses_i:
+        lines.append("    i = cpu.i")
+    lines += [f"    {line}" for line in body]
+    lines += [f"    v[{r}] = v{r:x}" for r in written]
+    if uses_i:
+        lines.append("    cpu.i = i")
+    return "\n".join(lines) + "\n", count, address
+
+
+# Basic-block JIT, compiles straight-line code into Python functions cached by start address
+class BlockCompiler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.blocks = {}  # Start address -> (function or None, instruction count, end address)
+        # (start address, length) -> (function, length, end address), the first instructions of a block
+        # that is longer than what was left of a cycle budget when it was reached
+        self.prefixes = {}
+        self.covered = bytearray(MEMORY_SIZE)  # 1 for every memory byte inside a compiled block
+        self.namespace = {}
+
+    # Function to compile generated source and return the function it defines
+    def compile_source(self, source, name):
+        exec(compile(source, f"<chip8 {name}>", "exec"), self.namespace)
+        return self.namespace.pop(name)
+
+    # Function to compile the block starting at address and add it to the cache
+    def compile_block(self, address):
+        name = f"block_{address:03X}"
+        source, count, end = generate_block(self.cpu.memory, address, name, self.cpu.quirks)
+        function = None
+        if source is not None:
+            function = self.compile_source(source, name)
+        # Addresses that can't be compiled are cached too, so the interpreter fallback is a dict hit
+        return self.add_block(address, function, count, max(end, address + 2))
+
+    # Function to compile the first length instructions of the block at address, cached like whole blocks
+    # Budgets repeat from frame to frame, so only a few lengths are ever compiled per address
+    def compile_prefix(self, address, length):
+        name = f"block_{address:03X}_{length}"
+        source, count, end = generate_block(self.cpu.memory, address, name, self.cpu.quirks, length)
+        prefix = self.prefixes[(address, length)] = (self.compile_source(source, name), count, end)
+        self.covered[address:end] = b"\x01" * (end - address)
+        return prefix
+
+    # Function to add an already compiled block to the cache, also used for ahead-of-time translated blocks
+    def add_block(self, address, function, count, end):
+        block = self.blocks[address] = (function, count, end)
+        self.covered[address:end] = b"\x01" * (end - address)
+        return block
+
+    # Function to drop compiled blocks overlapping a memory write
+    def invalidate(self, address, length=1):
+        end = address + length
+        if not any(self.covered[address:end]):
+            return
+
+        for start, block in list(self.blocks.items()):
+            if address < block[2] and end > start:
+                del self.blocks[start]
+        for key, prefix in list(self.prefixes.items()):
+            if address < prefix[2] and end > key[0]:
+                del self.prefixes[key]
+
+        # Rebuild the coverage map from the blocks that are left
+        self.covered[:] = bytes(MEMORY_SIZE)
+        for start, block in self.blocks.items():
+            self.covered[start:block[2]] = b"\x01" * (block[2] - start)
+        for (start, _), prefix in self.prefixes.items():
+            self.covered[start:prefix[2]] = b"\x01" * (prefix[2] - start)
+
+    # Run n instructions, whole blocks at a time, falling back to the interpreter where needed
+    # A block longer than what is left of n runs as a compiled prefix, so a run never overshoots n
+    def run_cycles(self, n):
+        cpu = self.cpu
+        blocks = self.blocks
+        prefixes = self.prefixes
+        step = cpu.step
+        remaining = n
+        while remaining > 0:
+            block = blocks.get(cpu.pc)
+            if block is None:
+                block = self.compile_block(cpu.pc)
+            function, count, _ = block
+
+            if function is None:
+                step()
+                remaining -= 1
+                continue
+            if count > remaining:
+                function, count, _ = prefixes.get((cpu.pc, remaining)) or self.compile_prefix(cpu.pc, remaining)
+
+            function(cpu)
+            cpu.cycles += count
+            remaining -= count
+
+        return cpu.display.rows
@@ -0,0 +1,138 @@
+# library.py
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+from batch import find_roms
+from cpu import CPU
+from quirks import QUIRK_PROFILES, detect_profile, is_schip_opcode, load_known_roms, rom_opcodes
+
+# ROM library index, one entry of static metadata per ROM path
+INDEX_PATH = os.path.join(os.path.expanduser("~"), ".cache", "chip8-emulator", "library.json")
+
+# Entries written by an older version are scanned again
+INDEX_VERSION = 1
+
+
+# Function to collect the static metadata of one ROM, run in a worker process
+# stat is (size, mtime_ns) as seen when the scan decided to read the file
+def scan_rom(path, stat, known_roms):
+    with open(path, "rb") as rom_file:
+        rom_data = rom_file.read()
+    entry = {"size": stat[0], "mtime_ns": stat[1], "sha256": hashlib.sha256(rom_data).hexdigest()}
+
+    try:
+        opcodes = rom_opcodes(rom_data)
+    except ValueError as error:
+        # Too large to load, only the hash is kept
+        entry["error"] = str(error)
+        return entry
+
+    # Opcode families are named after their handler like the profiler's opcode classes, e.g. op_8xy4 -> 8XY4
+    cpu = CPU()
+    families = set()
+    for opcode in set(opcodes.values()):
+        name = cpu.decode_opcode(opcode)[0].__name__
+        families.add(name.split("_")[1].upper() if name.startswith("op_") else "unknown")
+
+    entry["reachable_bytes"] = 2 * len(opcodes)
+    entry["opcode_families"] = sorted(families)
+    entry["schip"] = any(is_schip_opcode(opcode) for opcode in opcodes.values())
+    entry["quirks"] = detect_profile(rom_data, known_roms, opcodes)
+    return entry
+
+
+# Function to read the index, a missing, unreadable or outdated index counts as empty
+def load_index(path=INDEX_PATH):
+    try:
+        with open(path) as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+    if index.get("version") != INDEX_VERSION:
+        return {}
+    return index["roms"]
+
+
+# Function to write the index, through a temporary file so a reader never sees half of it
+def save_index(roms, path=INDEX_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as index_file:
+        json.dump({"version": INDEX_VERSION, "roms": roms}, index_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+# Function to bring the index up to date for the given ROM files and directories
+# Only files whose size or modification time changed are read again, entries for deleted files are dropped
+# Returns (ROMs scanned, entries removed)
+def update_index(roms, paths, workers=None):
+    deleted = [path for path in roms if not os.path.exists(path)]
+    for path in deleted:
+        del roms[path]
+
+    pending = {}
+    for path in find_roms(paths):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stat = (stat.st_size, stat.st_mtime_ns)
+        entry = roms.get(path)
+        if entry is None or (entry["size"], entry["mtime_ns"]) != stat:
+            pending[path] = stat
+
+    if pending:
+        known_roms = load_known_roms()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(scan_rom, path, stat, known_roms): path for path, stat in pending.items()}
+            for future in concurrent.futures.as_completed(futures):
+                roms[futures[future]] = future.result()
+    return len(pending), len(deleted)
+
+
+# Function to pick the index entries matching the filters, sorted by path
+def select(roms, schip=None, quirks=None, family=None):
+    for path in sorted(roms):
+        entry = roms[path]
+        if "error" in entry:
+            continue
+        if schip is not None and entry["schip"] != schip:
+            continue
+        if quirks is not None and entry["quirks"] != quirks:
+            continue
+        if family is not None and family.upper() not in entry["opcode_families"]:
+            continue
+        yield path, entry
+
+
+# Scan ROM directories into the index, or list what it holds as JSON lines batch.py --jobs can read
+def main(argv):
+    parser = argparse.ArgumentParser(description="Index a Chip-8 ROM library")
+    parser.add_argument("--index", default=INDEX_PATH, help="index file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="add ROM files or directories of .ch8 files to the index")
+    scan.add_argument("roms", nargs="+", help="ROM files or directories of .ch8 files")
+    scan.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+
+    listing = commands.add_parser("list", help="print one JSON line per indexed ROM")
+    listing.add_argument("--schip", action="store_true", default=None, help="only ROMs that use SCHIP opcodes")
+    listing.add_argument("--chip8", dest="schip", action="store_false", help="only ROMs that don't")
+    listing.add_argument("--quirks", choices=sorted(QUIRK_PROFILES), help="only ROMs with this suggested profile")
+    listing.add_argument("--family", help="only ROMs that use this opcode family, e.g. DXY0")
+    args = parser.parse_args(argv)
+
+    roms = load_index(args.index)
+    if args.command == "scan":
+        scanned, removed = update_index(roms, args.roms, args.workers)
+        save_index(roms, args.index)
+        print(f"{len(roms)} ROMs indexed, {scanned} scanned, {removed} removed")
+    else:
+        for path, entry in select(roms, args.schip, args.quirks, args.family):
+            print(json.dumps({"rom": path, **entry}))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
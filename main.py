@@ -1,10 +1,22 @@
 # main.py
 
+import aot
+import argparse
 import curses
-import time
+import random
 import sys
 from cpu import CPU  # Import the CPU class from cpu.py
+from display import Display, HeadlessDisplay
+from input import DEFAULT_HOLD_TIME, QUIT_KEY, read_host_keys
 from globals import status_items  # Import the status_items list from globals.py
+from globals import DEBUG_MODE
+from tracer import TraceBuffer, trace_file_path
+from scheduler import FrameScheduler, DEFAULT_INSTRUCTIONS_PER_FRAME
+from profiler import Profiler
+from replay import InputRecorder
+from threaded import ThreadedRunner
+from frames import FrameRecorder, SharedFramebuffer
+from quirks import QUIRK_PROFILES, detect_profile
 
 
 # Function to display a status line at the bottom of the screen
@@ -28,76 +40,151 @@ def display_status_line(stdscr):
     stdscr.addstr(height - 1, 0, status_str, curses.A_REVERSE)
 
 
+# Function to parse the command line options
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Chip-8 emulator")
+    parser.add_argument("rom", nargs="?", help="path to a Chip-8 ROM")
+    parser.add_argument("--ipf", type=int, default=DEFAULT_INSTRUCTIONS_PER_FRAME,
+                        help="instructions run per 60Hz frame")
+    parser.add_argument("--jit", action="store_true", help="run through the basic-block JIT")
+    parser.add_argument("--aot", action="store_true",
+                        help="translate the ROM ahead of time, cached on disk, implies --jit")
+    parser.add_argument("--key-hold", type=float, default=DEFAULT_HOLD_TIME,
+                        help="seconds a key stays down after its last press, terminals don't report releases")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile from the start and write the profile as JSON to PATH on exit")
+    parser.add_argument("--half-block", action="store_true",
+                        help="draw two Chip-8 rows per terminal row with half-block characters")
+    parser.add_argument("--threaded", action="store_true",
+                        help="emulate on a separate thread so terminal drawing never slows it down")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="record every frame to PATH on a background thread, convert it with frames.py")
+    parser.add_argument("--capture-format", choices=("stream", "pbm"), default="stream",
+                        help="a delta-encoded frame stream file, or a directory of PBM images of the changed frames")
+    parser.add_argument("--shared-frame", metavar="NAME",
+                        help="export each frame through the shared memory block NAME")
+    parser.add_argument("--quirks", choices=sorted(QUIRK_PROFILES),
+                        help="quirk profile, detected from the ROM by default")
+    parser.add_argument("--seed", type=int, help="seed for the CXKK random number generator")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record the seed and key events to PATH, play it back with replay.py")
+    args = parser.parse_args(argv)
+    if args.record and not args.rom:
+        parser.error("--record needs a ROM")
+    return args
+
+
 # Main curses function
-def main(stdscr):
+def main(stdscr, args):
 
     # Initialize ncurses
     curses.curs_set(0)  # Hide cursor
     stdscr.nodelay(True)  # Make getch non-blocking
-    stdscr.timeout(1)  # Set getch timeout to 100ms
+    stdscr.timeout(0)  # Don't wait for keys, the scheduler sleeps between frames
+    curses.set_escdelay(25)  # Report Esc, the quit key, without waiting a second for an escape sequence
 
     # Clear the screen
     stdscr.clear()
 
+    # A recording needs a known seed to reproduce CXKK
+    seed = args.seed
+    if args.record and seed is None:
+        seed = random.getrandbits(64)
+
+    # Threaded, the CPU draws on a headless display and the presenter copies its frames to the terminal
+    display = Display(stdscr, half_block=args.half_block)
+
     # create the cpu object from the CPU class
-    cpu = CPU(stdscr)
+    cpu = CPU(display=HeadlessDisplay() if args.threaded else display, jit=args.jit or args.aot, seed=seed)
+    cpu.keyboard.hold_time = args.key_hold
+
+    # In debug mode every instruction is recorded to the binary trace file, decode it with tracer.py
+    if DEBUG_MODE:
+        cpu.enable_tracing(TraceBuffer(path=trace_file_path))
 
     # Check if a ROM file was provided via command line parameter
-    if len(sys.argv) > 1:
-        rom_path = sys.argv[1]
-        cpu.load_rom(rom_path)
+    if args.rom:
+        cpu.load_rom(args.rom)
+        # Quirk handlers are bound before anything is compiled for them
+        with open(args.rom, "rb") as rom_file:
+            cpu.set_quirks(args.quirks or detect_profile(rom_file.read()))
+        if args.aot:
+            aot.install(cpu, args.rom)
     else:
         status_items["rom"] = "No ROM loaded"
 
-    # Timting variables
-    cpu_cycle_duration = 1 / 500  # 500Hz CPU cycle
-    screen_refresh_duration = 1 / 60  # 60Hz screen refresh
-
-    last_cpu_cycle_time = time.time()
-    last_screen_refresh_time = time.time()
+    scheduler = FrameScheduler(cpu, args.ipf)
+
+    # Profiler, toggled with the p key and shown on the status line while enabled
+    profiler = Profiler(cpu)
+    scheduler.profiler = profiler
+    if args.profile:
+        profiler.enable()
+
+    # Key changes and timer ticks are logged in CPU cycles so a replay can run at full speed
+    recorder = None
+    if args.record:
+        recorder = InputRecorder(cpu, seed, args.rom)
+        cpu.keyboard.recorder = recorder
+        scheduler.recorder = recorder
+
+    # Frame sinks get every finished frame from the display the CPU draws on
+    sinks = []
+
+    # Called after every frame with the host keys read since the last one, returns False to quit
+    def update_frame(host_keys):
+        # Feed keystrokes into the keyboard, Esc quits and p toggles the profiler
+        for key in cpu.keyboard.feed(host_keys):
+            if key == QUIT_KEY:
+                return False
+            if key == ord("p"):
+                profiler.toggle()
+                status_items.pop("profile", None)
+
+        # Update the status line items once per frame
+        status_items["frame_count"] = str(scheduler.frames % 60 + 1).zfill(2)
+        status_items["opcode"] = f"{cpu.fetch_opcode():04X}"
+        status_items["overruns"] = scheduler.report()
+        if profiler.enabled and scheduler.frames % 60 == 0:
+            status_items["profile"] = profiler.overlay()
+
+    # Called after every frame when emulating and drawing on this one thread
+    def on_frame():
+        if update_frame(read_host_keys(stdscr)) is False:
+            return False
 
-    # Main loop
-    frame_count = 0  # Frame counter
-
-    while True:
+        # Refresh the screen at 60Hz
+        display.display_status_line()
+        display.refresh()
+
+    # Outputs are written and sinks closed however the run ends, a shared framebuffer left behind by Ctrl-C
+    # or an error would stop the next run from creating one under the same name
+    try:
+        if args.capture:
+            sinks.append(FrameRecorder(args.capture, args.capture_format))
+        if args.shared_frame:
+            sinks.append(SharedFramebuffer(args.shared_frame))
+        for sink in sinks:
+            cpu.display.add_sink(sink)
+
+        if args.threaded:
+            ThreadedRunner(scheduler, display).run(stdscr, update_frame)
+        else:
+            scheduler.run(on_frame)
+    finally:
+        for sink in sinks:
+            sink.close()
 
-        # current time
-        current_time = time.time()
+        # Flush any buffered trace records
+        cpu.disable_tracing()
 
-        # Run CPU cycles at 500Hz
-        if current_time - last_cpu_cycle_time >= cpu_cycle_duration:
-            # Get keystrokes TODO: Implement all the key handling
-            key = stdscr.getch()
-            if key == ord("q"):
-                break
-            cpu.run()
-            last_cpu_cycle_time = current_time
+        if args.profile:
+            profiler.dump(args.profile)
 
-        # Refresh the screen at 60Hz
-        if current_time - last_screen_refresh_time >= screen_refresh_duration:
-            cpu.display.display_status_line()
-            cpu.display.refresh()
-            last_screen_refresh_time = current_time
-
-            # Increment the frame counter
-            frame_count += 1
-            if frame_count > 60:
-                frame_count = 1
-            status_items["frame_count"] = str(frame_count).zfill(2)
-
-        key = stdscr.getch()
-        if key != -1:
-            if key == ord("q"):
-                break
-            chip8_key = cpu.map_key_to_chip8(key)
-            if chip8_key != -1:
-                cpu.keys[chip8_key] = 1  # Key pressed
-            else:
-                cpu.keys = [0] * 16  # Reset keys if no valid key is pressed
-        else:
-            cpu.keys = [0] * 16  # Reset keys if no key is pressed
+        if recorder is not None:
+            recorder.save(args.record)
 
 
 # Run the main function
 if __name__ == "__main__":
-    curses.wrapper(main)
+    curses.wrapper(main, parse_arguments(sys.argv[1:]))
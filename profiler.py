@@ -0,0 +1,138 @@
+# profiler.py
+
+import json
+from array import array
+from cpu import MEMORY_SIZE, SYSTEM_OPCODES, SCROLL_OPCODES, PRIMARY_OPCODES, LARGE_SPRITE_OPCODES
+from cpu import ALU_OPCODES, KEY_OPCODES, MISC_OPCODES
+from input import WaitForKey
+
+# Opcode classes counted by the profiler, named after their handler, e.g. op_8xy4 -> 8XY4
+OPCODE_CLASSES = sorted(name[3:].upper() for table in (SYSTEM_OPCODES, SCROLL_OPCODES, PRIMARY_OPCODES,
+                                                        LARGE_SPRITE_OPCODES, ALU_OPCODES, KEY_OPCODES,
+                                                        MISC_OPCODES)
+                        for name, _ in table.values()) + ["unknown"]
+
+# Frames kept for the per-frame instruction counts and frame-time percentiles
+FRAME_HISTORY = 600
+
+
+# Execution profiler, swaps a counting step function into the CPU while enabled
+class Profiler:
+    def __init__(self, cpu):
+        self.cpu = cpu
+        self.enabled = False
+        self.next_step = None  # Step function profiled_step wraps, set by CPU.add_step_hook
+
+        # Preallocated counters
+        self.opcode_counts = array("Q", [0]) * len(OPCODE_CLASSES)
+        self.pc_counts = array("Q", [0]) * MEMORY_SIZE
+        self.frame_instructions = array("Q", [0]) * FRAME_HISTORY
+        self.frame_times = array("d", [0.0]) * FRAME_HISTORY
+        self.frames = 0
+
+        # Opcode -> index into OPCODE_CLASSES, filled in as opcodes are first seen
+        self.opcode_classes = {}
+
+    # Function to start counting, the CPU runs through profiled_step until disable
+    def enable(self):
+        if self.enabled:
+            return
+        self.cpu.add_step_hook(self, self.profiled_step)
+        self.enabled = True
+
+    # Function to stop counting and take profiled_step out of the CPU's step chain
+    def disable(self):
+        if not self.enabled:
+            return
+        self.cpu.remove_step_hook(self)
+        self.enabled = False
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    # Function to find the class index of an opcode
+    def classify(self, opcode):
+        handler = self.cpu.decode_opcode(opcode)[0]
+        name = handler.__name__
+        index = OPCODE_CLASSES.index(name.split("_")[1].upper() if name.startswith("op_") else "unknown")
+        self.opcode_classes[opcode] = index
+        return index
+
+    # Function to count the instruction at PC and then execute it
+    def profiled_step(self):
+        cpu = self.cpu
+        pc = cpu.pc
+        opcode = cpu.memory[pc] << 8 | cpu.memory[pc + 1]
+        index = self.opcode_classes.get(opcode)
+        if index is None:
+            index = self.classify(opcode)
+        self.opcode_counts[index] += 1
+        self.pc_counts[pc] += 1
+        try:
+            self.next_step()
+        except WaitForKey:
+            # A waiting FX0A didn't run and isn't in cpu.cycles, it is counted when a key lets it finish
+            self.opcode_counts[index] -= 1
+            self.pc_counts[pc] -= 1
+            raise
+
+    # Function to record one frame's instruction count and how long it took, in seconds
+    def record_frame(self, instructions, frame_time):
+        slot = self.frames % FRAME_HISTORY
+        self.frame_instructions[slot] = instructions
+        self.frame_times[slot] = frame_time
+        self.frames += 1
+
+    # Function to return the most executed PC addresses as (address, count) pairs
+    def hot_pcs(self, count=16):
+        ranked = sorted(range(MEMORY_SIZE), key=self.pc_counts.__getitem__, reverse=True)[:count]
+        return [(pc, self.pc_counts[pc]) for pc in ranked if self.pc_counts[pc]]
+
+    # Function to return the given frame-time percentiles in milliseconds
+    def frame_time_percentiles(self, percentiles=(50, 90, 99)):
+        times = sorted(self.frame_times[:min(self.frames, FRAME_HISTORY)])
+        if not times:
+            return {percentile: 0.0 for percentile in percentiles}
+        return {percentile: times[min(len(times) - 1, len(times) * percentile // 100)] * 1000
+                for percentile in percentiles}
+
+    # Function to return the kept per-frame instruction counts, oldest first
+    def recent_frame_instructions(self):
+        if self.frames <= FRAME_HISTORY:
+            return list(self.frame_instructions[:self.frames])
+        slot = self.frames % FRAME_HISTORY
+        return list(self.frame_instructions[slot:]) + list(self.frame_instructions[:slot])
+
+    # Function to summarize the profile in a single status line item
+    def overlay(self):
+        total = sum(self.opcode_counts)
+        if not total:
+            return "no samples"
+        top = max(range(len(OPCODE_CLASSES)), key=self.opcode_counts.__getitem__)
+        hot = self.hot_pcs(1)
+        frames = min(self.frames, FRAME_HISTORY)
+        instructions = sum(self.frame_instructions[:frames]) / frames if frames else 0
+        p99 = self.frame_time_percentiles((99,))[99]
+        return (f"top {OPCODE_CLASSES[top]} {self.opcode_counts[top] * 100 // total}% "
+                f"hot {hot[0][0]:03X} ipf {instructions:.0f} p99 {p99:.1f}ms")
+
+    # Function to collect the whole profile as a JSON-ready dict
+    def to_dict(self):
+        frames = min(self.frames, FRAME_HISTORY)
+        return {
+            "opcode_counts": {name: self.opcode_counts[index]
+                              for index, name in enumerate(OPCODE_CLASSES) if self.opcode_counts[index]},
+            "hot_pcs": [{"pc": f"{pc:03X}", "count": count} for pc, count in self.hot_pcs()],
+            "frames": self.frames,
+            "instructions_per_frame": self.recent_frame_instructions(),
+            "frame_time_ms": {f"p{percentile}": round(value, 3)
+                              for percentile, value in self.frame_time_percentiles().items()},
+        }
+
+    # Function to write the profile to a JSON file
+    def dump(self, path):
+        with open(path, "w") as profile_file:
+            json.dump(self.to_dict(), profile_file, indent=2)
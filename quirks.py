@@ -0,0 +1,90 @@
+# quirks.py
+
+import hashlib
+import json
+import os
+
+# Quirk flags of each interpreter family, programs written for one often misbehave on another
+#   shift_vy:        8XY6/8XYE shift Vy into Vx instead of shifting Vx in place
+#   index_increment: FX55/FX65 leave I at I + X + 1 ("x+1"), at I + X ("x"), or unchanged (None)
+#   jump_vx:         BNNN is BXNN, a jump to XNN + VX instead of NNN + V0
+#   vf_reset:        8XY1/8XY2/8XY3 reset VF to 0
+#   clip:            sprites are cut off at the screen edges instead of wrapping around
+QUIRK_PROFILES = {
+    "cosmac": {"shift_vy": True, "index_increment": "x+1", "jump_vx": False, "vf_reset": True, "clip": True},
+    "chip48": {"shift_vy": False, "index_increment": "x", "jump_vx": True, "vf_reset": False, "clip": True},
+    "schip": {"shift_vy": False, "index_increment": None, "jump_vx": True, "vf_reset": False, "clip": True},
+    "modern": {"shift_vy": False, "index_increment": None, "jump_vx": False, "vf_reset": False, "clip": False},
+}
+
+DEFAULT_PROFILE = "modern"
+
+# Handler variants each quirk binds in place of the standard handler, by handler name
+QUIRK_HANDLERS = {
+    "shift_vy": {"op_8xy6": "op_8xy6_vy", "op_8xye": "op_8xye_vy"},
+    "jump_vx": {"op_bnnn": "op_bxnn"},
+    "vf_reset": {"op_8xy1": "op_8xy1_vf_reset", "op_8xy2": "op_8xy2_vf_reset", "op_8xy3": "op_8xy3_vf_reset"},
+}
+INDEX_INCREMENT_HANDLERS = {
+    "x+1": {"op_fx55": "op_fx55_increment", "op_fx65": "op_fx65_increment"},
+    "x": {"op_fx55": "op_fx55_increment_x", "op_fx65": "op_fx65_increment_x"},
+}
+
+# JSON file of ROM SHA-256 -> profile name for ROMs whose profile is known
+KNOWN_ROMS_PATH = os.path.join(os.path.expanduser("~"), ".config", "chip8-emulator", "quirks.json")
+
+# Opcodes only SCHIP programs use, checked with (mask, value) pairs
+SCHIP_OPCODES = ((0xFFF0, 0x00C0), (0xFFFF, 0x00FB), (0xFFFF, 0x00FC), (0xFFFF, 0x00FD), (0xFFFF, 0x00FE),
+                 (0xFFFF, 0x00FF), (0xF00F, 0xD000), (0xF0FF, 0xF030), (0xF0FF, 0xF075), (0xF0FF, 0xF085))
+
+
+# Function to map standard handler names to the variants a profile binds instead
+def handler_overrides(profile):
+    quirks = QUIRK_PROFILES[profile]
+    overrides = {}
+    for quirk, handlers in QUIRK_HANDLERS.items():
+        if quirks[quirk]:
+            overrides.update(handlers)
+    if quirks["index_increment"] is not None:
+        overrides.update(INDEX_INCREMENT_HANDLERS[quirks["index_increment"]])
+    return overrides
+
+
+# Function to check whether an opcode is one of the SCHIP extensions
+def is_schip_opcode(opcode):
+    return any(opcode & mask == value for mask, value in SCHIP_OPCODES)
+
+
+# Function to read the known ROM table, a missing or unreadable file counts as empty
+def load_known_roms(path=KNOWN_ROMS_PATH):
+    try:
+        with open(path) as known_file:
+            return json.load(known_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Function to list the instructions reachable in a ROM as address -> opcode
+def rom_opcodes(rom_data):
+    # Imported here since the control-flow walk needs the CPU, which needs this module
+    from aot import reachable_opcodes
+    from cpu import CPU
+    cpu = CPU()
+    cpu.load_program(rom_data)
+    return reachable_opcodes(cpu.memory)
+
+
+# Function to pick a profile for a ROM, by hash if it is known, otherwise SCHIP if its reachable code
+# uses SCHIP opcodes and the default profile if not, opcodes are the reachable ones if already listed
+def detect_profile(rom_data, known_roms=None, opcodes=None):
+    if known_roms is None:
+        known_roms = load_known_roms()
+    profile = known_roms.get(hashlib.sha256(rom_data).hexdigest())
+    if profile in QUIRK_PROFILES:
+        return profile
+
+    if opcodes is None:
+        opcodes = rom_opcodes(rom_data)
+    if any(is_schip_opcode(opcode) for opcode in opcodes.values()):
+        return "schip"
+    return DEFAULT_PROFILE
@@ -0,0 +1,139 @@
+# replay.py
+
+import argparse
+import hashlib
+import struct
+import sys
+import time
+import zlib
+from batch import framebuffer_hash
+from cpu import CPU
+
+# Recording header: magic, format version, the rest of the file is zlib compressed
+RECORDING_MAGIC = b"C8IR"
+RECORDING_VERSION = 3
+HEADER_FORMAT = struct.Struct("<4sH")
+
+# Seed for the CXKK random generator, SHA-256 of the ROM, quirk profile name
+START_FORMAT = struct.Struct("<Q32s8s")
+
+# One event: cycles since the previous event, event code
+EVENT_FORMAT = struct.Struct("<IB")
+
+# Event codes, key down and key up carry the key in the low nibble
+KEY_DOWN = 0x00
+KEY_UP = 0x10
+FRAME = 0x20  # The timers ticked
+END = 0xFF  # Followed by the SHA-1 of the final framebuffer
+
+
+# Records the seed, quirk profile, key changes and timer ticks of a session, timed in CPU cycles
+class InputRecorder:
+    def __init__(self, cpu, seed, rom_path):
+        self.cpu = cpu
+        self.seed = seed  # Must be the seed the CPU was created with
+        with open(rom_path, "rb") as rom_file:
+            self.rom_hash = hashlib.sha256(rom_file.read()).digest()
+        self.events = bytearray()  # Packed EVENT_FORMAT records
+        self.last_cycle = cpu.cycles
+
+    # Function to log an event at the current cycle
+    def add(self, code):
+        cycle = self.cpu.cycles
+        self.events += EVENT_FORMAT.pack(cycle - self.last_cycle, code)
+        self.last_cycle = cycle
+
+    # Function to log a key change, called by Keyboard
+    def key(self, key, pressed):
+        self.add((KEY_DOWN if pressed else KEY_UP) | key)
+
+    # Function to log a timer tick, called by FrameScheduler
+    def frame(self):
+        self.add(FRAME)
+
+    # Function to end the recording with the final framebuffer hash and write it to path
+    def save(self, path):
+        events = self.events + EVENT_FORMAT.pack(self.cpu.cycles - self.last_cycle, END)
+        data = START_FORMAT.pack(self.seed, self.rom_hash, self.cpu.quirk_profile.encode()) + events + bytes.fromhex(framebuffer_hash(self.cpu.display))
+        with open(path, "wb") as recording_file:
+            recording_file.write(HEADER_FORMAT.pack(RECORDING_MAGIC, RECORDING_VERSION) + zlib.compress(data, 9))
+
+
+# Function to read a recording made by InputRecorder
+# Returns (seed, ROM SHA-256, quirk profile, list of (cycle, event code) ending with END, final framebuffer SHA-1)
+def load_recording(path):
+    with open(path, "rb") as recording_file:
+        blob = recording_file.read()
+    magic, version = HEADER_FORMAT.unpack_from(blob)
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError(f"{path} isn't a version {RECORDING_VERSION} Chip-8 input recording")
+    data = zlib.decompress(blob[HEADER_FORMAT.size:])
+
+    seed, rom_hash, profile = START_FORMAT.unpack_from(data)
+    offset = START_FORMAT.size
+    events = []
+    cycle = 0
+    while True:
+        delta, code = EVENT_FORMAT.unpack_from(data, offset)
+        offset += EVENT_FORMAT.size
+        cycle += delta
+        events.append((cycle, code))
+        if code == END:
+            break
+    return seed, rom_hash.hex(), profile.rstrip(b"\0").decode(), events, data[offset:offset + 20].hex()
+
+
+# Function to replay a recording on a headless CPU as fast as possible and return a result dict
+def replay(rom_path, recording_path, jit=False):
+    seed, rom_hash, profile, events, expected_hash = load_recording(recording_path)
+    with open(rom_path, "rb") as rom_file:
+        rom_data = rom_file.read()
+    if hashlib.sha256(rom_data).hexdigest() != rom_hash:
+        raise ValueError(f"{recording_path} was recorded with a different ROM")
+
+    cpu = CPU(jit=jit, seed=seed, quirks=profile)
+    cpu.load_program(rom_data)
+    frames = 0
+
+    start = time.perf_counter()
+    for cycle, code in events:
+        if cycle > cpu.cycles:
+            cpu.run_cycles(cycle - cpu.cycles)
+            # Only a run that went differently can stall on FX0A before the next event
+            if cpu.cycles != cycle:
+                raise ValueError(f"Replay diverged at cycle {cpu.cycles}, the next event is at cycle {cycle}")
+        if code == FRAME:
+            cpu.tick_timers()
+            frames += 1
+        elif code == END:
+            break
+        elif code & 0xF0 == KEY_DOWN:
+            cpu.keyboard.press(code & 0xF)
+        else:
+            cpu.keyboard.release(code & 0xF)
+    elapsed = time.perf_counter() - start
+
+    framebuffer_sha1 = framebuffer_hash(cpu.display)
+    return {"cycles": cpu.cycles, "frames": frames, "seconds": round(elapsed, 3),
+            "framebuffer_sha1": framebuffer_sha1, "expected_sha1": expected_hash,
+            "match": framebuffer_sha1 == expected_hash}
+
+
+# Replay a recording headless, with --check the exit status says whether the final frame matched
+def main(argv):
+    parser = argparse.ArgumentParser(description="Replay a Chip-8 input recording at full speed")
+    parser.add_argument("rom", help="the ROM the recording was made with")
+    parser.add_argument("recording", help="recording written by main.py --record")
+    parser.add_argument("--jit", action="store_true", help="run through the basic-block JIT")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if the final frame differs")
+    args = parser.parse_args(argv)
+
+    result = replay(args.rom, args.recording, args.jit)
+    print(f"{result['frames']} frames, {result['cycles']} instructions in {result['seconds']}s, "
+          f"final frame {'matches' if result['match'] else 'differs'}")
+    if args.check and not result["match"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,72 @@
+# scheduler.py
+
+import time
+
+# The Chip-8 timers and display run at 60Hz
+FRAME_RATE = 60
+
+# Instructions run per frame, 10 per frame is about 600 instructions per second
+DEFAULT_INSTRUCTIONS_PER_FRAME = 10
+
+
+# Frame-paced scheduler, runs a batch of instructions per 60Hz frame and sleeps until the next one
+class FrameScheduler:
+    def __init__(self, cpu, instructions_per_frame=DEFAULT_INSTRUCTIONS_PER_FRAME, frame_rate=FRAME_RATE):
+        self.cpu = cpu
+        self.instructions_per_frame = instructions_per_frame
+        self.frame_duration = 1 / frame_rate
+
+        self.frames = 0  # Frames run so far
+        self.overruns = 0  # Frames that finished after their deadline
+        self.worst_overrun = 0.0  # Longest time past a deadline, in seconds
+        self.next_deadline = None
+
+        # Optional profiler that gets each frame's instruction count and run time
+        self.profiler = None
+
+        # Optional InputRecorder that logs each timer tick
+        self.recorder = None
+
+    # Function to run one frame worth of instructions, tick the timers once and publish the frame to the display's sinks
+    def run_frame(self):
+        self.cpu.run_cycles(self.instructions_per_frame)
+        self.cpu.tick_timers()
+        self.cpu.display.publish()
+        if self.recorder is not None:
+            self.recorder.frame()
+        self.frames += 1
+
+    # Function to sleep until the next frame deadline, counting the frame as an overrun if it is already late
+    def wait_for_next_frame(self):
+        now = time.perf_counter()
+        if self.next_deadline is None:
+            self.next_deadline = now
+        self.next_deadline += self.frame_duration
+
+        delay = self.next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            return
+
+        self.overruns += 1
+        self.worst_overrun = max(self.worst_overrun, -delay)
+
+        # More than a frame behind, drop the missed frames instead of trying to catch up
+        if -delay > self.frame_duration:
+            self.next_deadline = now
+
+    # Main loop, on_frame is called after every frame and returns False to stop
+    def run(self, on_frame):
+        while True:
+            start = time.perf_counter()
+            cycles = self.cpu.cycles
+            self.run_frame()
+            if on_frame() is False:
+                break
+            if self.profiler is not None and self.profiler.enabled:
+                self.profiler.record_frame(self.cpu.cycles - cycles, time.perf_counter() - start)
+            self.wait_for_next_frame()
+
+    # Function to summarize the frame timing for the status line
+    def report(self):
+        return f"{self.overruns} (worst {self.worst_overrun * 1000:.1f}ms)"
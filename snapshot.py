@@ -0,0 +1,156 @@
+# snapshot.py
+
+import collections
+import struct
+import zlib
+from cpu import MEMORY_SIZE
+
+# Save-state blob header: magic, format version
+STATE_MAGIC = b"C8SS"
+STATE_VERSION = 4
+HEADER_FORMAT = struct.Struct("<4sH")
+
+# Registers and counters: V0 - VF, I, PC, SP, delay timer, sound timer, cycles, keys, RPL user flags,
+# CXKK random generator state, stack depth, width, height
+REGISTER_FORMAT = struct.Struct("<16sHHHBBQ16s16sIBBB")
+
+# Memory is compared in pages when taking in-memory snapshots
+PAGE_SIZE = 256
+PAGE_COUNT = MEMORY_SIZE // PAGE_SIZE
+
+
+# Function to serialize the full machine into a compact versioned blob
+def save_state(cpu):
+    display = cpu.display
+    registers = REGISTER_FORMAT.pack(bytes(cpu.v), cpu.i, cpu.pc, cpu.sp, cpu.delay_timer, cpu.sound_timer,
+                                     cpu.cycles, bytes(cpu.keys), bytes(cpu.rpl_flags), cpu.rng_state,
+                                     len(cpu.stack), display.width, display.height)
+    stack = struct.pack(f"<{len(cpu.stack)}H", *cpu.stack)
+    row_bytes = display.width // 8
+    rows = b"".join(row.to_bytes(row_bytes, "big") for row in display.rows)
+    data = registers + stack + bytes(cpu.memory) + rows
+    return HEADER_FORMAT.pack(STATE_MAGIC, STATE_VERSION) + zlib.compress(data)
+
+
+# Function to restore a machine from a blob made by save_state
+def load_state(cpu, blob):
+    magic, version = HEADER_FORMAT.unpack_from(blob)
+    if magic != STATE_MAGIC or version != STATE_VERSION:
+        raise ValueError(f"Not a version {STATE_VERSION} Chip-8 save state")
+    data = zlib.decompress(blob[HEADER_FORMAT.size:])
+
+    v, i, pc, sp, delay_timer, sound_timer, cycles, keys, rpl_flags, rng_state, depth, width, height = \
+        REGISTER_FORMAT.unpack_from(data)
+    offset = REGISTER_FORMAT.size
+    stack = list(struct.unpack_from(f"<{depth}H", data, offset))
+    offset += 2 * depth
+    memory = data[offset:offset + MEMORY_SIZE]
+    offset += MEMORY_SIZE
+    row_bytes = width // 8
+    rows = [int.from_bytes(data[offset + row * row_bytes:offset + (row + 1) * row_bytes], "big")
+            for row in range(height)]
+
+    restore_registers(cpu, (list(v), i, pc, stack, sp, delay_timer, sound_timer, list(keys), list(rpl_flags), cycles,
+                            rng_state))
+    cpu.memory[:] = memory
+    cpu.invalidate_code(0, MEMORY_SIZE)
+    cpu.display.set_resolution(width, height)
+    cpu.display.rows[:] = rows
+
+
+# Function to copy the registers, counters and random generator state out of a machine
+def capture_registers(cpu):
+    return (cpu.v[:], cpu.i, cpu.pc, cpu.stack[:], cpu.sp, cpu.delay_timer, cpu.sound_timer, cpu.keys[:],
+            cpu.rpl_flags[:], cpu.cycles, cpu.rng_state)
+
+
+# Function to put registers and counters captured by capture_registers back
+def restore_registers(cpu, registers):
+    (v, cpu.i, cpu.pc, stack, cpu.sp, cpu.delay_timer, cpu.sound_timer, keys, rpl_flags, cpu.cycles,
+     cpu.rng_state) = registers
+    cpu.v[:] = v
+    cpu.stack[:] = stack
+    cpu.keys[:] = keys
+    cpu.rpl_flags[:] = rpl_flags
+
+
+# One in-memory snapshot, pages only holds the memory pages that changed since the snapshot before it
+class Snapshot:
+    __slots__ = ("registers", "width", "rows", "pages")
+
+    def __init__(self, registers, width, rows, pages):
+        self.registers = registers
+        self.width = width  # Screen width, the height is the number of rows
+        self.rows = rows
+        self.pages = pages  # Page index -> page bytes
+
+
+# History of cheap in-memory snapshots storing copy-on-write memory deltas
+class SnapshotHistory:
+    def __init__(self, cpu, capacity=600):
+        self.cpu = cpu
+        self.capacity = capacity  # Snapshots kept, the oldest are folded away beyond this
+        self.snapshots = collections.deque()
+        self.previous_memory = None  # Memory as of the newest snapshot
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    # Function to take a snapshot, returns its index counted from the oldest kept snapshot
+    def take(self):
+        memory = bytes(self.cpu.memory)
+        previous = self.previous_memory
+        if previous is None:
+            pages = {page: memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] for page in range(PAGE_COUNT)}
+        else:
+            pages = {}
+            for page in range(PAGE_COUNT):
+                start = page * PAGE_SIZE
+                end = start + PAGE_SIZE
+                if memory[start:end] != previous[start:end]:
+                    pages[page] = memory[start:end]
+
+        registers = capture_registers(self.cpu)
+        display = self.cpu.display
+        self.snapshots.append(Snapshot(registers, display.width, tuple(display.rows), pages))
+        self.previous_memory = memory
+
+        if len(self.snapshots) > self.capacity:
+            # Fold the oldest snapshot's pages into the next one so it becomes the full base
+            oldest = self.snapshots.popleft()
+            base = self.snapshots[0]
+            for page, data in oldest.pages.items():
+                base.pages.setdefault(page, data)
+
+        return len(self.snapshots) - 1
+
+    # Function to put the machine back to snapshot index, newer snapshots are dropped
+    def restore(self, index=-1):
+        if index < 0:
+            index += len(self.snapshots)
+        snapshot = self.snapshots[index]
+
+        # Walk back from the snapshot to find the newest copy of every page
+        pages = {}
+        for position in range(index, -1, -1):
+            for page, data in self.snapshots[position].pages.items():
+                pages.setdefault(page, data)
+            if len(pages) == PAGE_COUNT:
+                break
+
+        # Only rewrite, and invalidate cached code for, pages that differ from the live memory
+        cpu = self.cpu
+        for page, data in pages.items():
+            start = page * PAGE_SIZE
+            if cpu.memory[start:start + PAGE_SIZE] != data:
+                cpu.memory[start:start + PAGE_SIZE] = data
+                cpu.invalidate_code(start, PAGE_SIZE)
+
+        restore_registers(cpu, snapshot.registers)
+        if (cpu.display.width, cpu.display.height) != (snapshot.width, len(snapshot.rows)):
+            cpu.display.set_resolution(snapshot.width, len(snapshot.rows))
+        cpu.display.rows[:] = snapshot.rows
+
+        while len(self.snapshots) > index + 1:
+            self.snapshots.pop()
+        self.previous_memory = bytes(cpu.memory)
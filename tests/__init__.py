@@ -0,0 +1,2 @@
+# tests/__init__.py
+# Differential tests checking the engines and file formats against the interpreter, run with: python3 -m unittest
@@ -0,0 +1,71 @@
+# tests/fuzz.py
+
+from benchmarks.roms import assemble
+from cpu import PROGRAM_START_ADDRESS
+from snapshot import capture_registers
+
+# Opcode families random programs are drawn from, repeated families come up more often
+# S stands for the SCHIP extensions
+BASE_FAMILIES = "0112233456677888888899ABCDDDEF"
+SCHIP_FAMILIES = BASE_FAMILIES + "SSS"
+
+# FX opcodes random programs use, FX0A waits for a key
+FX_OPCODES = (0x07, 0x15, 0x18, 0x1E, 0x29, 0x33, 0x55, 0x65)
+
+
+# Function to generate a random program of length instructions
+# Jumps and calls land on the program's own instructions and I points into it, so most programs run for a while
+def random_rom(rng, length=96, families=BASE_FAMILIES, key_wait=True):
+    fx_opcodes = FX_OPCODES + (0x0A,) if key_wait else FX_OPCODES
+    opcodes = []
+    for _ in range(length):
+        family = rng.choice(families)
+        x = rng.randrange(16)
+        y = rng.randrange(16)
+        target = PROGRAM_START_ADDRESS + 2 * rng.randrange(length)
+        if family == "0":
+            opcodes.append(rng.choice((0x00E0, 0x00EE)))
+        elif family in "12B":
+            opcodes.append(int(family, 16) << 12 | target)
+        elif family in "3467C":
+            opcodes.append(int(family, 16) << 12 | x << 8 | rng.randrange(256))
+        elif family in "59":
+            opcodes.append(int(family, 16) << 12 | x << 8 | y << 4)
+        elif family == "8":
+            opcodes.append(0x8000 | x << 8 | y << 4 | rng.choice((0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xE)))
+        elif family == "A":
+            opcodes.append(0xA000 | rng.randrange(PROGRAM_START_ADDRESS, PROGRAM_START_ADDRESS + 2 * length))
+        elif family == "D":
+            opcodes.append(0xD000 | x << 8 | y << 4 | rng.randrange(1, 16))
+        elif family == "E":
+            opcodes.append(0xE000 | x << 8 | rng.choice((0x9E, 0xA1)))
+        elif family == "F":
+            opcodes.append(0xF000 | x << 8 | rng.choice(fx_opcodes))
+        else:
+            opcodes.append(rng.choice((0x00C0 | rng.randrange(1, 16), 0x00FB, 0x00FC, 0x00FE, 0x00FF,
+                                       0xD000 | x << 8 | y << 4, 0xF030 | x << 8, 0xF075 | x << 8,
+                                       0xF085 | x << 8)))
+    return assemble(opcodes)
+
+
+# Function to run frames of instructions_per_frame instructions, ticking the timers and pressing a key
+# every few frames so the key opcodes see both states
+# Returns the machine state, or the error a random program ran into
+def run_frames(cpu, frames, instructions_per_frame):
+    try:
+        for frame in range(frames):
+            now = frame / 60
+            if frame % 7 == 3:
+                cpu.keyboard.press(frame % 16, now)
+            cpu.keyboard.update(now)
+            cpu.run_cycles(instructions_per_frame)
+            cpu.tick_timers()
+    except Exception as error:
+        return repr(error)
+    return machine_state(cpu)
+
+
+# Function to capture everything a program can observe or change
+def machine_state(cpu):
+    display = cpu.display
+    return capture_registers(cpu), display.width, tuple(display.rows), bytes(cpu.memory), cpu.exited
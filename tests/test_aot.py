@@ -0,0 +1,72 @@
+# tests/test_aot.py
+
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import aot
+from benchmarks.roms import ROMS
+from cpu import CPU
+from quirks import QUIRK_PROFILES
+from tests.fuzz import SCHIP_FAMILIES, random_rom, run_frames
+
+# Random programs translated per quirk profile
+ROMS_PER_PROFILE = 15
+
+
+class AOTTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.directory.name, "cache")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Function to write a program to a ROM file for install to read
+    def write_rom(self, name, rom):
+        path = os.path.join(self.directory.name, f"{name}.ch8")
+        with open(path, "wb") as rom_file:
+            rom_file.write(rom)
+        return path
+
+    # Function to run a ROM file with its translation installed, returns (came from the cache, final state)
+    def run_translated(self, path, profile):
+        cpu = CPU(jit=True, seed=7, quirks=profile)
+        cpu.load_rom(path)
+        cached = aot.install(cpu, path, self.cache)
+        return cached, run_frames(cpu, 40, 10)
+
+    # Translated code, freshly generated or imported from the cache, must run like the interpreter
+    def check_rom(self, path, profile):
+        cpu = CPU(seed=7, quirks=profile)
+        cpu.load_rom(path)
+        expected = run_frames(cpu, 40, 10)
+        self.assertEqual(self.run_translated(path, profile), (False, expected))
+        self.assertEqual(self.run_translated(path, profile), (True, expected))
+
+    def test_random_roms_match_interpreter(self):
+        rng = random.Random(15)
+        for profile in QUIRK_PROFILES:
+            for index in range(ROMS_PER_PROFILE):
+                path = self.write_rom(f"{profile}-{index}", random_rom(rng, families=SCHIP_FAMILIES))
+                with self.subTest(profile=profile, rom=index):
+                    self.check_rom(path, profile)
+
+    def test_benchmark_roms_match_interpreter(self):
+        for name, make_rom in ROMS.items():
+            with self.subTest(rom=name):
+                self.check_rom(self.write_rom(name, make_rom()), "modern")
+
+    # Translations made by other generator sources, or before a cache version bump, aren't picked up
+    def test_cache_key_follows_generator(self):
+        fingerprint = aot.generator_fingerprint()
+        self.assertTrue(aot.cache_path("0" * 64, "modern", self.cache).endswith(f"-modern-{fingerprint}.py"))
+        with mock.patch.object(aot, "CACHE_VERSION", aot.CACHE_VERSION + 1):
+            self.assertNotEqual(aot.generator_fingerprint(), fingerprint)
+        self.assertEqual({os.path.basename(path) for path in aot.GENERATOR_SOURCES},
+                         {"aot.py", "jit.py", "cpu.py", "quirks.py"})
+
+
+if __name__ == "__main__":
+    unittest.main()
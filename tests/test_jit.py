@@ -0,0 +1,82 @@
+# tests/test_jit.py
+
+import random
+import unittest
+from benchmarks.roms import ROMS, assemble
+from cpu import CPU
+from quirks import QUIRK_PROFILES
+from tests.fuzz import SCHIP_FAMILIES, random_rom, run_frames
+
+# Random programs run per quirk profile
+ROMS_PER_PROFILE = 60
+
+# Instructions per frame, small batches end compiled blocks early and large ones run many blocks per batch
+BATCH_SIZES = (1, 3, 7, 10, 13, 64, 100)
+
+# Programs that spend most of their time in the idle loops run_cycles skips
+IDLE_ROMS = {
+    "delay_poll": assemble([0x6010, 0xF015, 0xF007, 0x3000, 0x1204, 0x7101, 0xA050, 0xD125, 0x6010, 0xF015, 0x1204]),
+    "delay_poll_4xkk": assemble([0x6010, 0xF015, 0xF207, 0x4207, 0x1204, 0x7101, 0x1200]),
+    "jump_to_self": assemble([0x6010, 0xF015, 0x1204]),
+    "key_poll": assemble([0x6105, 0xE19E, 0x1202, 0x7301, 0xA050, 0xD345, 0xE1A1, 0x120C, 0x1202]),
+    "key_wait": assemble([0xF00A, 0x7001, 0xF015, 0xF107, 0x3100, 0x1206, 0x1200]),
+    "exit": assemble([0x6005, 0x00FD]),
+}
+
+
+# Function to run a program on a fresh CPU and return its final state
+def run_rom(rom, jit, profile, frames, instructions_per_frame, idle_skipping=True):
+    cpu = CPU(jit=jit, seed=7, quirks=profile)
+    if not idle_skipping:
+        cpu.loop_is_idle = lambda address, period: False
+    cpu.load_program(rom)
+    return run_frames(cpu, frames, instructions_per_frame)
+
+
+class JITTest(unittest.TestCase):
+    def test_random_roms_match_interpreter(self):
+        rng = random.Random(3)
+        for profile in QUIRK_PROFILES:
+            for index in range(ROMS_PER_PROFILE):
+                rom = random_rom(rng, families=SCHIP_FAMILIES)
+                instructions_per_frame = rng.choice(BATCH_SIZES)
+                with self.subTest(profile=profile, rom=index, instructions_per_frame=instructions_per_frame):
+                    self.assertEqual(run_rom(rom, True, profile, 40, instructions_per_frame),
+                                     run_rom(rom, False, profile, 40, instructions_per_frame))
+
+    def test_benchmark_roms_match_interpreter(self):
+        for name, make_rom in ROMS.items():
+            for instructions_per_frame in BATCH_SIZES:
+                with self.subTest(rom=name, instructions_per_frame=instructions_per_frame):
+                    self.assertEqual(run_rom(make_rom(), True, "modern", 20, instructions_per_frame),
+                                     run_rom(make_rom(), False, "modern", 20, instructions_per_frame))
+
+
+class IdleSkippingTest(unittest.TestCase):
+    # Skipping an idle loop must leave the machine as running every pass of it would
+    def test_skipping_matches_running_the_loop(self):
+        for name, rom in IDLE_ROMS.items():
+            for jit in (False, True):
+                for instructions_per_frame in BATCH_SIZES:
+                    with self.subTest(rom=name, jit=jit, instructions_per_frame=instructions_per_frame):
+                        self.assertEqual(run_rom(rom, jit, "modern", 60, instructions_per_frame),
+                                         run_rom(rom, jit, "modern", 60, instructions_per_frame, False))
+
+    def test_random_roms(self):
+        rng = random.Random(4)
+        for index in range(ROMS_PER_PROFILE):
+            rom = random_rom(rng)
+            with self.subTest(rom=index):
+                self.assertEqual(run_rom(rom, False, "modern", 40, 10),
+                                 run_rom(rom, False, "modern", 40, 10, False))
+
+    def test_idle_loops_are_skipped(self):
+        cpu = CPU()
+        cpu.load_program(IDLE_ROMS["jump_to_self"])
+        cpu.run_cycles(100)
+        self.assertEqual(cpu.cycles, 100)
+        self.assertGreater(cpu.idle_cycles, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# tests/test_replay.py
+
+import os
+import random
+import tempfile
+import unittest
+from cpu import CPU
+from replay import END, FRAME, InputRecorder, load_recording, replay
+from scheduler import FrameScheduler
+from tests.fuzz import random_rom
+
+# Random programs recorded and replayed
+ROM_COUNT = 30
+
+# Frames recorded per session
+FRAMES = 120
+
+
+class RecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rom_path = os.path.join(self.directory.name, "rom.ch8")
+        self.recording_path = os.path.join(self.directory.name, "session.c8r")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Function to record a session of a program with random key presses, returns the CPU or None if it crashed
+    def record(self, rom, seed, rng):
+        with open(self.rom_path, "wb") as rom_file:
+            rom_file.write(rom)
+        cpu = CPU(seed=seed)
+        cpu.load_rom(self.rom_path)
+        scheduler = FrameScheduler(cpu, 13)
+        recorder = InputRecorder(cpu, seed, self.rom_path)
+        cpu.keyboard.recorder = recorder
+        scheduler.recorder = recorder
+        try:
+            for frame in range(FRAMES):
+                scheduler.run_frame()
+                now = (frame + 1) / 60
+                if rng.random() < 0.2:
+                    cpu.keyboard.press(rng.randrange(16), now)
+                cpu.keyboard.update(now)
+        except IndexError:
+            return None
+        recorder.save(self.recording_path)
+        return cpu
+
+    # A replay, on either engine, must take the same path as the recorded run and end on the same frame
+    def test_replay_matches_recorded_run(self):
+        rng = random.Random(16)
+        replayed = 0
+        for index in range(ROM_COUNT):
+            cpu = self.record(random_rom(rng), rng.randrange(1 << 32), rng)
+            if cpu is None:
+                continue
+            replayed += 1
+            for jit in (False, True):
+                with self.subTest(rom=index, jit=jit):
+                    result = replay(self.rom_path, self.recording_path, jit)
+                    self.assertTrue(result["match"])
+                    self.assertEqual((result["cycles"], result["frames"]), (cpu.cycles, FRAMES))
+        self.assertGreater(replayed, ROM_COUNT // 2)
+
+    def test_recording_round_trip(self):
+        cpu = self.record(bytes([0xC0, 0xFF, 0xF1, 0x0A, 0x12, 0x00]), 1234, random.Random(1))
+        seed, rom_hash, profile, events, _ = load_recording(self.recording_path)
+        self.assertEqual((seed, profile), (1234, cpu.quirk_profile))
+        self.assertEqual(sum(code == FRAME for _, code in events), FRAMES)
+        self.assertEqual(events[-1], (cpu.cycles, END))
+
+    def test_rejects_a_different_rom(self):
+        self.record(bytes([0x12, 0x00]), 1, random.Random(1))
+        with open(self.rom_path, "wb") as rom_file:
+            rom_file.write(bytes([0x12, 0x02]))
+        with self.assertRaises(ValueError):
+            replay(self.rom_path, self.recording_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
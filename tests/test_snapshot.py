@@ -0,0 +1,109 @@
+# tests/test_snapshot.py
+
+import random
+import unittest
+from benchmarks.roms import assemble
+from cpu import CPU
+from snapshot import SnapshotHistory, load_state, save_state
+from tests.fuzz import SCHIP_FAMILIES, machine_state, random_rom, run_frames
+
+# Random programs saved and restored
+ROM_COUNT = 40
+
+
+# Function to run frames without key presses, a restored machine doesn't know when held keys are let go
+def run_plain(cpu, frames, instructions_per_frame=10):
+    for _ in range(frames):
+        cpu.run_cycles(instructions_per_frame)
+        cpu.tick_timers()
+
+
+# Function to start a random program and run it for a while, or None if it crashed
+def started_cpu(rng):
+    cpu = CPU(seed=rng.randrange(1 << 32))
+    cpu.load_program(random_rom(rng, families=SCHIP_FAMILIES))
+    return cpu if isinstance(run_frames(cpu, 20, 10), tuple) else None
+
+
+class SaveStateTest(unittest.TestCase):
+    # A loaded state must be the saved machine, and both must go on to run the same way
+    def test_round_trip(self):
+        rng = random.Random(10)
+        for index in range(ROM_COUNT):
+            cpu = started_cpu(rng)
+            if cpu is None:
+                continue
+            with self.subTest(rom=index):
+                restored = CPU()
+                load_state(restored, save_state(cpu))
+                self.assertEqual(machine_state(restored), machine_state(cpu))
+                try:
+                    run_plain(cpu, 20)
+                    run_plain(restored, 20)
+                except IndexError:
+                    continue
+                self.assertEqual(machine_state(restored), machine_state(cpu))
+
+    # A save state is mostly memory, which compresses well
+    def test_blob_is_compact(self):
+        cpu = CPU(seed=1)
+        cpu.load_program(bytes([0xC0, 0xFF, 0xC1, 0xFF, 0x71, 0x01, 0x12, 0x00]))
+        run_plain(cpu, 60)
+        self.assertLess(len(save_state(cpu)), 1024)
+
+    def test_rejects_other_data(self):
+        with self.assertRaises(ValueError):
+            load_state(CPU(), b"C8SS\xff\xff")
+
+
+class SnapshotHistoryTest(unittest.TestCase):
+    # Restoring any kept snapshot must bring back the machine as it was when the snapshot was taken,
+    # and it must go on from there as it did the first time
+    def test_restore(self):
+        rng = random.Random(11)
+        for index in range(ROM_COUNT):
+            cpu = started_cpu(rng)
+            if cpu is None:
+                continue
+            with self.subTest(rom=index):
+                history = SnapshotHistory(cpu, capacity=8)
+                states = []
+                try:
+                    for _ in range(12):
+                        history.take()
+                        states.append(machine_state(cpu))
+                        run_plain(cpu, 1)
+                except IndexError:
+                    continue
+                # Only the newest capacity snapshots are kept
+                kept = states[-len(history):]
+                for position in (5, 2, 0):
+                    history.restore(position)
+                    self.assertEqual(machine_state(cpu), kept[position])
+                    run_plain(cpu, 1)
+                    self.assertEqual(machine_state(cpu), kept[position + 1])
+                    history.restore(position)
+                self.assertEqual(len(history), 1)
+
+    # Code cached after a later write must be dropped when restoring the memory from before it
+    def test_restore_drops_stale_code(self):
+        # Calls the subroutine at 210, rewrites its first instruction with FX55 and calls it again
+        rom = assemble([0x2210, 0xA210, 0x6070, 0x6101, 0xF155, 0x2210, 0x120C, 0x0000, 0x6A05, 0x00EE])
+        for jit in (False, True):
+            with self.subTest(jit=jit):
+                expected = CPU(jit=jit, seed=1)
+                expected.load_program(rom)
+                expected.run_cycles(2)
+
+                cpu = CPU(jit=jit, seed=1)
+                cpu.load_program(rom)
+                history = SnapshotHistory(cpu)
+                history.take()
+                cpu.run_cycles(20)
+                history.restore(0)
+                cpu.run_cycles(2)
+                self.assertEqual(machine_state(cpu), machine_state(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
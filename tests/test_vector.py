@@ -0,0 +1,73 @@
+# tests/test_vector.py
+
+import random
+import unittest
+from cpu import CPU
+from tests.fuzz import random_rom
+
+try:
+    import numpy as np
+    from vector import LockstepMachines
+except ImportError:
+    np = None
+
+# Random programs run side by side, and lockstep instructions run on each
+MACHINES = 200
+STEPS = 300
+
+# Lockstep instructions between timer ticks
+STEPS_PER_TICK = 10
+
+
+@unittest.skipIf(np is None, "the lockstep engine needs NumPy")
+class LockstepTest(unittest.TestCase):
+    # Every machine that neither engine stopped must end up exactly like a CPU running the same program
+    def test_random_roms_match_interpreter(self):
+        rng = random.Random(9)
+        # FX0A is left out, a lockstep machine takes a held key instead of waiting for a press
+        roms = [random_rom(rng, key_wait=False) for _ in range(MACHINES)]
+
+        machines = LockstepMachines(MACHINES)
+        cpus = []
+        for index, rom in enumerate(roms):
+            machines.memory[index, 0x200:0x200 + len(rom)] = np.frombuffer(rom, dtype=np.uint8)
+            # LockstepMachines seeds machine n with n + 1 by default, the CPU draws the same CXKK bytes
+            cpu = CPU(seed=index + 1)
+            cpu.load_program(rom)
+            cpus.append(cpu)
+
+        stopped = set()
+        for step in range(STEPS):
+            machines.step()
+            for index, cpu in enumerate(cpus):
+                if index in stopped:
+                    continue
+                try:
+                    cpu.run_cycles(1)
+                except IndexError:
+                    stopped.add(index)
+            if step % STEPS_PER_TICK == STEPS_PER_TICK - 1:
+                machines.tick_timers()
+                for cpu in cpus:
+                    cpu.tick_timers()
+
+        compared = 0
+        for index, cpu in enumerate(cpus):
+            # A call deeper than the lockstep stack, or a PC running off memory, faults the machine instead
+            if index in stopped or machines.faulted[index] or len(cpu.stack) > 16 or cpu.pc > 0xFFE:
+                continue
+            compared += 1
+            with self.subTest(machine=index):
+                self.assertEqual(int(machines.pc[index]), cpu.pc)
+                self.assertEqual(machines.v[index].tolist(), cpu.v)
+                self.assertEqual(int(machines.i[index]), cpu.i)
+                self.assertEqual(machines.stack[index, :machines.sp[index]].tolist(), cpu.stack)
+                self.assertEqual((int(machines.delay_timer[index]), int(machines.sound_timer[index])),
+                                 (cpu.delay_timer, cpu.sound_timer))
+                self.assertEqual(machines.memory[index].tobytes(), bytes(cpu.memory))
+                self.assertEqual([int(row) for row in machines.rows[index]], cpu.display.rows)
+        self.assertGreater(compared, MACHINES // 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# threaded.py
+
+import queue
+import threading
+import time
+from globals import status_items
+from input import read_host_keys
+from scheduler import FRAME_RATE
+
+
+# Double buffer handing finished frames from the emulation thread to the presenter
+class FrameExchange:
+    def __init__(self, height):
+        self.buffers = ([0] * height, [0] * height)
+        self.front = 0  # Index of the buffer holding the latest published frame
+        self.sequence = 0  # Frames published so far
+        self.width = 0  # Width of the latest frame, it changes with the SCHIP resolution
+        self.status = {}  # Status items as of the latest frame
+        self.lock = threading.Lock()
+
+    # Function to publish a finished frame and its status items, called by the emulation thread
+    def publish(self, rows, width, status):
+        # The back buffer is never read, so it is filled without holding the lock
+        back = self.buffers[self.front ^ 1]
+        back[:] = rows
+        with self.lock:
+            self.front ^= 1
+            self.width = width
+            self.status = status
+            self.sequence += 1
+
+    # Function to get (sequence, rows, width, status items) for the latest frame, the rows are a copy
+    def latest(self):
+        with self.lock:
+            return self.sequence, list(self.buffers[self.front]), self.width, self.status
+
+
+# Runs the frame scheduler on its own thread while this thread draws frames and reads keys,
+# so slow terminal writes never take time from emulation
+class ThreadedRunner:
+    def __init__(self, scheduler, display, frame_rate=FRAME_RATE):
+        self.scheduler = scheduler
+        self.display = display  # Curses display the presenter draws on, the CPU draws on its own headless one
+        self.frame_duration = 1 / frame_rate
+        self.frames = FrameExchange(display.height)
+        self.host_keys = queue.SimpleQueue()  # Key codes read by the presenter, applied between frames
+        self.stopped = threading.Event()
+        self.error = None  # Exception that ended the emulation thread
+
+    # Function to run the emulation thread, on_frame(host_keys) is called after every frame and returns False to stop
+    def emulate(self, on_frame):
+        cpu = self.scheduler.cpu
+
+        def frame():
+            host_keys = []
+            while True:
+                try:
+                    host_keys.append(self.host_keys.get_nowait())
+                except queue.Empty:
+                    break
+            if self.stopped.is_set() or on_frame(host_keys) is False:
+                return False
+            self.frames.publish(cpu.display.rows, cpu.display.width, dict(status_items))
+
+        try:
+            self.scheduler.run(frame)
+        except BaseException as error:
+            self.error = error
+        finally:
+            self.stopped.set()
+
+    # Function to start the emulation thread and present its frames until it stops
+    def run(self, stdscr, on_frame):
+        thread = threading.Thread(target=self.emulate, args=(on_frame,), name="chip8-emulation", daemon=True)
+        thread.start()
+
+        presented = 0
+        try:
+            while not self.stopped.is_set():
+                for key in read_host_keys(stdscr):
+                    self.host_keys.put(key)
+
+                sequence, rows, width, status = self.frames.latest()
+                if sequence != presented:
+                    presented = sequence
+                    self.display.present(rows, width)
+                    self.display.display_status_line(status)
+                    stdscr.refresh()
+
+                time.sleep(self.frame_duration)
+        finally:
+            self.stopped.set()
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
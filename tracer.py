@@ -0,0 +1,147 @@
+# tracer.py
+
+import os
+import struct
+import sys
+
+# Trace file header: magic, format version, record size
+TRACE_MAGIC = b"C8TR"
+TRACE_VERSION = 1
+HEADER_FORMAT = struct.Struct("<4sHH")
+
+# One record per executed instruction: cycle, PC, opcode, I, V0 - VF
+RECORD_FORMAT = struct.Struct("<IHHH16B")
+
+# Default trace file path, next to the debug log
+trace_file_path = os.path.join(os.path.dirname(__file__), "chip8_trace.bin")
+
+
+# Fixed-size ring buffer of instruction trace records
+class TraceBuffer:
+    def __init__(self, capacity=65536, path=None):
+        self.capacity = capacity
+        self.path = path  # Where full buffers are flushed, None keeps only the last capacity records
+        self.buffer = bytearray(RECORD_FORMAT.size * capacity)
+        self.position = 0  # Next record slot
+        self.wrapped = False  # True once older records have been overwritten
+        self.trace_file = None
+        self.next_step = None  # Step function CPU.traced_step wraps, set by CPU.add_step_hook
+
+    # Function to add one record, called before every traced instruction
+    def record(self, cycle, pc, opcode, i, v):
+        RECORD_FORMAT.pack_into(self.buffer, self.position * RECORD_FORMAT.size,
+                                cycle & 0xFFFFFFFF, pc, opcode, i & 0xFFFF, *v)
+        self.position += 1
+        if self.position == self.capacity:
+            if self.path is not None:
+                self.flush()
+            else:
+                self.position = 0
+                self.wrapped = True
+
+    # Function to return the buffered records in execution order
+    def records(self):
+        end = self.position * RECORD_FORMAT.size
+        if self.wrapped:
+            return bytes(self.buffer[end:]) + bytes(self.buffer[:end])
+        return bytes(self.buffer[:end])
+
+    # Function to write the buffered records to the trace file in one go
+    def flush(self):
+        if self.path is None:
+            return
+        if self.trace_file is None:
+            self.trace_file = open(self.path, "wb")
+            self.trace_file.write(HEADER_FORMAT.pack(TRACE_MAGIC, TRACE_VERSION, RECORD_FORMAT.size))
+        self.trace_file.write(self.records())
+        self.position = 0
+        self.wrapped = False
+
+    def close(self):
+        self.flush()
+        if self.trace_file is not None:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+# Function to turn an opcode into a short mnemonic
+def disassemble(opcode):
+    x = (opcode & 0x0F00) >> 8
+    y = (opcode & 0x00F0) >> 4
+    n = opcode & 0x000F
+    kk = opcode & 0x00FF
+    nnn = opcode & 0x0FFF
+    first_nibble = (opcode & 0xF000) >> 12
+
+    if opcode == 0x00E0:
+        return "CLS"
+    if opcode == 0x00EE:
+        return "RET"
+    schip = {0x00FB: "SCR", 0x00FC: "SCL", 0x00FD: "EXIT", 0x00FE: "LOW", 0x00FF: "HIGH"}
+    if opcode in schip:
+        return schip[opcode]
+    if opcode & 0xFFF0 == 0x00C0:
+        return f"SCD {n:X}"
+    if opcode & 0xFFF0 == 0x00D0:
+        return f"SCU {n:X}"
+    if first_nibble == 0x1:
+        return f"JP {nnn:03X}"
+    if first_nibble == 0x2:
+        return f"CALL {nnn:03X}"
+    if first_nibble == 0x3:
+        return f"SE V{x:X}, {kk:02X}"
+    if first_nibble == 0x4:
+        return f"SNE V{x:X}, {kk:02X}"
+    if first_nibble == 0x5 and n == 0x0:
+        return f"SE V{x:X}, V{y:X}"
+    if first_nibble == 0x6:
+        return f"LD V{x:X}, {kk:02X}"
+    if first_nibble == 0x7:
+        return f"ADD V{x:X}, {kk:02X}"
+    if first_nibble == 0x8:
+        alu = {0x0: "LD", 0x1: "OR", 0x2: "AND", 0x3: "XOR", 0x4: "ADD", 0x5: "SUB", 0x6: "SHR", 0x7: "SUBN", 0xE: "SHL"}
+        if n in alu:
+            return f"{alu[n]} V{x:X}, V{y:X}"
+    if first_nibble == 0x9 and n == 0x0:
+        return f"SNE V{x:X}, V{y:X}"
+    if first_nibble == 0xA:
+        return f"LD I, {nnn:03X}"
+    if first_nibble == 0xB:
+        return f"JP V0, {nnn:03X}"
+    if first_nibble == 0xC:
+        return f"RND V{x:X}, {kk:02X}"
+    if first_nibble == 0xD:
+        return f"DRW V{x:X}, V{y:X}, {n:X}"
+    if first_nibble == 0xE and kk == 0x9E:
+        return f"SKP V{x:X}"
+    if first_nibble == 0xE and kk == 0xA1:
+        return f"SKNP V{x:X}"
+    if first_nibble == 0xF:
+        misc = {0x07: f"LD V{x:X}, DT", 0x0A: f"LD V{x:X}, K", 0x15: f"LD DT, V{x:X}", 0x18: f"LD ST, V{x:X}",
+                0x1E: f"ADD I, V{x:X}", 0x29: f"LD F, V{x:X}", 0x30: f"LD HF, V{x:X}", 0x33: f"LD B, V{x:X}",
+                0x55: f"LD [I], V{x:X}", 0x65: f"LD V{x:X}, [I]", 0x75: f"LD R, V{x:X}", 0x85: f"LD V{x:X}, R"}
+        if kk in misc:
+            return misc[kk]
+    return f"DW {opcode:04X}"
+
+
+# Function to read a trace file and yield one line of text per record
+def decode_trace(path):
+    with open(path, "rb") as trace_file:
+        magic, version, record_size = HEADER_FORMAT.unpack(trace_file.read(HEADER_FORMAT.size))
+        if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != RECORD_FORMAT.size:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} trace file")
+
+        while True:
+            data = trace_file.read(RECORD_FORMAT.size * 4096)
+            if not data:
+                break
+            for cycle, pc, opcode, i, *v in RECORD_FORMAT.iter_unpack(data):
+                registers = " ".join(f"{value:02X}" for value in v)
+                yield f"{cycle:10d}  {pc:03X}  {opcode:04X}  {disassemble(opcode):<16} I={i:03X}  V={registers}"
+
+
+# Decode a trace file to text: python3 tracer.py chip8_trace.bin
+if __name__ == "__main__":
+    for line in decode_trace(sys.argv[1] if len(sys.argv) > 1 else trace_file_path):
+        print(line)
@@ -0,0 +1,326 @@
+# vector.py
+
+import sys
+import time
+import numpy as np
+from cpu import MEMORY_SIZE, FONT_START, FONT_SET, BIG_FONT_START, BIG_FONT_SET, PROGRAM_START_ADDRESS
+
+# Display size, rows are packed into uint64 the same way as Display.rows
+WIDTH = 64
+HEIGHT = 32
+
+# Call stack depth per machine, a deeper call faults the machine
+STACK_DEPTH = 16
+
+
+# Lockstep engine, N Chip-8 machines stored as NumPy arrays and stepped one instruction at a time together
+# Semantics follow CPU's opcode handlers, CXKK draws from the same xorshift32 generator as a CPU given the same seed,
+# except FX0A which takes the lowest key held in keys instead of the oldest queued key press
+# Only the 64x32 base machine with the modern quirk profile is modelled, a machine that runs an SCHIP opcode is faulted
+class LockstepMachines:
+    def __init__(self, count, seeds=None):
+        self.count = count
+        self.memory = np.zeros((count, MEMORY_SIZE), dtype=np.uint8)
+        self.memory[:, FONT_START:FONT_START + len(FONT_SET)] = FONT_SET
+        self.memory[:, BIG_FONT_START:BIG_FONT_START + len(BIG_FONT_SET)] = BIG_FONT_SET
+        self.v = np.zeros((count, 16), dtype=np.uint8)
+        self.i = np.zeros(count, dtype=np.int64)
+        self.pc = np.full(count, PROGRAM_START_ADDRESS, dtype=np.int64)
+        self.stack = np.zeros((count, STACK_DEPTH), dtype=np.int64)
+        self.sp = np.zeros(count, dtype=np.int64)
+        self.delay_timer = np.zeros(count, dtype=np.int64)
+        self.sound_timer = np.zeros(count, dtype=np.int64)
+        self.keys = np.zeros((count, 16), dtype=np.uint8)
+        self.rows = np.zeros((count, HEIGHT), dtype=np.uint64)
+        self.cycles = 0
+        self.unknown_opcodes = np.zeros(count, dtype=np.int64)
+
+        # Machines that hit an invalid PC, stack or memory access stop where they are
+        self.faulted = np.zeros(count, dtype=bool)
+        self.live = np.arange(count)
+
+        # Per-machine xorshift32 state for CXKK, a zero state would stay zero so seeds are forced odd
+        if seeds is None:
+            seeds = np.arange(1, count + 1)
+        self.rng_state = (np.asarray(seeds, dtype=np.uint64) * 2 + 1).astype(np.uint32)
+
+    # Function to load the same ROM into every machine
+    def load_rom(self, rom_path):
+        with open(rom_path, "rb") as rom_file:
+            rom_data = np.frombuffer(rom_file.read(), dtype=np.uint8)
+        self.memory[:, PROGRAM_START_ADDRESS:PROGRAM_START_ADDRESS + len(rom_data)] = rom_data
+
+    # Function to count the timers down, called once per 60Hz frame
+    def tick_timers(self):
+        np.subtract(self.delay_timer, 1, out=self.delay_timer, where=self.delay_timer > 0)
+        np.subtract(self.sound_timer, 1, out=self.sound_timer, where=self.sound_timer > 0)
+
+    # Function to run n lockstep instructions on every live machine
+    def run_cycles(self, n):
+        for _ in range(n):
+            self.step()
+        return self.rows
+
+    # Function to stop the given machines
+    def fault(self, machines):
+        if len(machines):
+            self.faulted[machines] = True
+            self.live = np.nonzero(~self.faulted)[0]
+
+    # Function to draw a random byte for each of the given machines
+    def random_bytes(self, machines):
+        state = self.rng_state[machines]
+        state ^= state << np.uint32(13)
+        state ^= state >> np.uint32(17)
+        state ^= state << np.uint32(5)
+        self.rng_state[machines] = state
+        return (state >> np.uint32(24)).astype(np.uint8)
+
+    # Function to execute one instruction on every live machine, grouped by opcode family
+    def step(self):
+        live = self.live
+        pc = self.pc[live]
+
+        # A PC without a whole opcode in memory faults the machine
+        bad = pc > MEMORY_SIZE - 2
+        if bad.any():
+            self.fault(live[bad])
+            live = self.live
+            pc = self.pc[live]
+
+        opcode = (self.memory[live, pc].astype(np.int64) << 8) | self.memory[live, pc + 1]
+        self.pc[live] = pc + 2
+        self.cycles += 1
+
+        family = opcode >> 12
+        for first_nibble in np.unique(family):
+            group = family == first_nibble
+            machines = live[group]
+            codes = opcode[group]
+            FAMILY_HANDLERS[first_nibble](self, machines, codes)
+
+    # Opcode family handlers, each gets the machine indices and their opcodes, PC already advanced
+
+    def family_0(self, machines, codes):
+        clear = machines[codes == 0x00E0]
+        self.rows[clear] = 0
+
+        ret = machines[codes == 0x00EE]
+        empty = ret[self.sp[ret] == 0]
+        self.fault(empty)
+        ret = ret[self.sp[ret] > 0]
+        self.sp[ret] -= 1
+        self.pc[ret] = self.stack[ret, self.sp[ret]]
+
+        schip = ((codes & 0xFFE0) == 0x00C0) | ((codes >= 0x00FB) & (codes <= 0x00FF))
+        self.fault(machines[schip])
+        self.unknown_opcodes[machines[(codes != 0x00E0) & (codes != 0x00EE) & ~schip]] += 1
+
+    def family_1(self, machines, codes):  # 1NNN: Jump to address NNN
+        self.pc[machines] = codes & 0x0FFF
+
+    def family_2(self, machines, codes):  # 2NNN: Call subroutine at NNN
+        full = self.sp[machines] >= STACK_DEPTH
+        self.fault(machines[full])
+        machines = machines[~full]
+        codes = codes[~full]
+        self.stack[machines, self.sp[machines]] = self.pc[machines]
+        self.sp[machines] += 1
+        self.pc[machines] = codes & 0x0FFF
+
+    def family_3(self, machines, codes):  # 3XKK: Skip next instruction if Vx == kk
+        vx = self.v[machines, (codes >> 8) & 0xF]
+        self.pc[machines] += 2 * (vx == (codes & 0xFF))
+
+    def family_4(self, machines, codes):  # 4XKK: Skip next instruction if Vx != kk
+        vx = self.v[machines, (codes >> 8) & 0xF]
+        self.pc[machines] += 2 * (vx != (codes & 0xFF))
+
+    def family_5(self, machines, codes):  # 5XY0: Skip next instruction if Vx == Vy
+        vx = self.v[machines, (codes >> 8) & 0xF]
+        vy = self.v[machines, (codes >> 4) & 0xF]
+        self.pc[machines] += 2 * (vx == vy)
+
+    def family_6(self, machines, codes):  # 6XKK: Set Vx = kk
+        self.v[machines, (codes >> 8) & 0xF] = codes & 0xFF
+
+    def family_7(self, machines, codes):  # 7XKK: Set Vx = Vx + kk
+        x = (codes >> 8) & 0xF
+        self.v[machines, x] = (self.v[machines, x].astype(np.int64) + (codes & 0xFF)) & 0xFF
+
+    def family_8(self, machines, codes):  # 8XYN: Register arithmetic, keyed by the last nibble
+        x = (codes >> 8) & 0xF
+        y = (codes >> 4) & 0xF
+        n = codes & 0xF
+        v = self.v
+
+        for last_nibble in np.unique(n):
+            group = n == last_nibble
+            m = machines[group]
+            gx = x[group]
+            vx = v[m, gx].astype(np.int64)
+            vy = v[m, y[group]].astype(np.int64)
+
+            # VF is written before Vx, so Vx wins when X is F, same as the interpreter
+            if last_nibble == 0x0:
+                v[m, gx] = vy
+            elif last_nibble == 0x1:
+                v[m, gx] = vx | vy
+            elif last_nibble == 0x2:
+                v[m, gx] = vx & vy
+            elif last_nibble == 0x3:
+                v[m, gx] = vx ^ vy
+            elif last_nibble == 0x4:
+                result = vx + vy
+                v[m, 0xF] = result > 0xFF
+                v[m, gx] = result & 0xFF
+            elif last_nibble == 0x5:
+                v[m, 0xF] = vx >= vy
+                v[m, gx] = (vx - vy) & 0xFF
+            elif last_nibble == 0x6:
+                v[m, 0xF] = vx & 0x1
+                v[m, gx] = v[m, gx] >> 1
+            elif last_nibble == 0x7:
+                v[m, 0xF] = vy >= vx
+                v[m, gx] = (vy - vx) & 0xFF
+            elif last_nibble == 0xE:
+                v[m, 0xF] = (vx & 0x80) >> 7
+                v[m, gx] = (v[m, gx].astype(np.int64) << 1) & 0xFF
+            else:
+                self.unknown_opcodes[m] += 1
+
+    def family_9(self, machines, codes):  # 9XY0: Skip next instruction if Vx != Vy
+        vx = self.v[machines, (codes >> 8) & 0xF]
+        vy = self.v[machines, (codes >> 4) & 0xF]
+        self.pc[machines] += 2 * (vx != vy)
+
+    def family_a(self, machines, codes):  # ANNN: Set I = NNN
+        self.i[machines] = codes & 0x0FFF
+
+    def family_b(self, machines, codes):  # BNNN: Jump to address NNN + V0
+        self.pc[machines] = (codes & 0x0FFF) + self.v[machines, 0]
+
+    def family_c(self, machines, codes):  # CXKK: Set Vx = random byte AND kk
+        self.v[machines, (codes >> 8) & 0xF] = self.random_bytes(machines) & (codes & 0xFF)
+
+    def family_d(self, machines, codes):  # DXYN: Display n-byte sprite at (Vx, Vy)
+        # DXY0 is SCHIP's 16x16 sprite
+        large = (codes & 0xF) == 0
+        self.fault(machines[large])
+        machines = machines[~large]
+        codes = codes[~large]
+
+        x = self.v[machines, (codes >> 8) & 0xF].astype(np.int64) % WIDTH
+        y = self.v[machines, (codes >> 4) & 0xF].astype(np.int64)
+        n = codes & 0xF
+        i = self.i[machines]
+        collision = np.zeros(len(machines), dtype=bool)
+
+        # Shift that lines the sprite's leftmost bit up with column x, negative when the sprite wraps
+        shift = WIDTH - 8 - x
+        left = np.maximum(shift, 0).astype(np.uint64)
+        right = np.maximum(-shift, 0).astype(np.uint64)
+        wrap = (WIDTH + np.minimum(shift, 0)).astype(np.uint64)
+
+        for byte_index in range(int(n.max()) if len(n) else 0):
+            # The sprite slice stops at the end of memory, like memory[i:i + n]
+            drawn = (n > byte_index) & (i + byte_index < MEMORY_SIZE)
+            if not drawn.any():
+                break
+            m = machines[drawn]
+            sprite_byte = self.memory[m, i[drawn] + byte_index].astype(np.uint64)
+            bits = np.where(shift[drawn] >= 0,
+                            sprite_byte << left[drawn],
+                            (sprite_byte >> right[drawn]) | (sprite_byte << wrap[drawn]))
+            row = (y[drawn] + byte_index) % HEIGHT
+            current = self.rows[m, row]
+            collision[drawn] |= (current & bits) != 0
+            self.rows[m, row] = current ^ bits
+
+        self.v[machines, 0xF] = collision
+
+    def family_e(self, machines, codes):  # EX9E/EXA1: Skip next instruction if key Vx is / is not pressed
+        last_byte = codes & 0xFF
+        pressed = self.keys[machines, self.v[machines, (codes >> 8) & 0xF] & 0xF] != 0
+        self.pc[machines] += 2 * (((last_byte == 0x9E) & pressed) | ((last_byte == 0xA1) & ~pressed))
+        self.unknown_opcodes[machines[(last_byte != 0x9E) & (last_byte != 0xA1)]] += 1
+
+    def family_f(self, machines, codes):  # FXKK: Timers, I and memory moves, keyed by the last byte
+        x = (codes >> 8) & 0xF
+        last_byte = codes & 0xFF
+        v = self.v
+
+        for kind in np.unique(last_byte):
+            group = last_byte == kind
+            m = machines[group]
+            gx = x[group]
+
+            if kind == 0x07:  # FX07: Set Vx = delay timer value
+                v[m, gx] = self.delay_timer[m]
+            elif kind == 0x0A:  # FX0A: Wait for a key press, store the lowest pressed key in Vx
+                pressed = self.keys[m].any(axis=1)
+                v[m[pressed], gx[pressed]] = self.keys[m[pressed]].argmax(axis=1)
+                self.pc[m[~pressed]] -= 2
+            elif kind == 0x15:  # FX15: Set delay timer = Vx
+                self.delay_timer[m] = v[m, gx]
+            elif kind == 0x18:  # FX18: Set sound timer = Vx
+                self.sound_timer[m] = v[m, gx]
+            elif kind == 0x1E:  # FX1E: Set I = I + Vx
+                self.i[m] = (self.i[m] + v[m, gx]) & 0xFFFF
+            elif kind == 0x29:  # FX29: Set I = location of sprite for digit Vx
+                self.i[m] = FONT_START + v[m, gx].astype(np.int64) * 5
+            elif kind == 0x33:  # FX33: Store BCD representation of Vx at I, I+1 and I+2
+                m, gx = self.check_memory(m, gx, 3)
+                vx = v[m, gx]
+                i = self.i[m]
+                self.memory[m, i] = vx // 100
+                self.memory[m, i + 1] = (vx // 10) % 10
+                self.memory[m, i + 2] = vx % 10
+            elif kind == 0x55:  # FX55: Store registers V0 through Vx starting at I
+                m, gx = self.check_memory(m, gx, gx + 1)
+                for register_index in range(int(gx.max()) + 1 if len(gx) else 0):
+                    stored = gx >= register_index
+                    self.memory[m[stored], self.i[m[stored]] + register_index] = v[m[stored], register_index]
+            elif kind == 0x65:  # FX65: Read registers V0 through Vx starting at I
+                m, gx = self.check_memory(m, gx, gx + 1)
+                for register_index in range(int(gx.max()) + 1 if len(gx) else 0):
+                    loaded = gx >= register_index
+                    v[m[loaded], register_index] = self.memory[m[loaded], self.i[m[loaded]] + register_index]
+            elif kind in (0x30, 0x75, 0x85):  # SCHIP big font and RPL user flags
+                self.fault(m)
+            else:
+                self.unknown_opcodes[m] += 1
+
+    # Function to fault machines whose access of length bytes at I runs past memory, returns the rest
+    def check_memory(self, machines, x, length):
+        bad = self.i[machines] + length > MEMORY_SIZE
+        self.fault(machines[bad])
+        return machines[~bad], x[~bad]
+
+
+# Opcode family handlers indexed by the first nibble
+FAMILY_HANDLERS = [
+    LockstepMachines.family_0, LockstepMachines.family_1, LockstepMachines.family_2, LockstepMachines.family_3,
+    LockstepMachines.family_4, LockstepMachines.family_5, LockstepMachines.family_6, LockstepMachines.family_7,
+    LockstepMachines.family_8, LockstepMachines.family_9, LockstepMachines.family_a, LockstepMachines.family_b,
+    LockstepMachines.family_c, LockstepMachines.family_d, LockstepMachines.family_e, LockstepMachines.family_f,
+]
+
+
+# Function to measure aggregate instructions per second as the number of machines grows
+def benchmark(rom_path, counts=(1, 10, 100, 1000, 10000), steps=200):
+    results = []
+    for count in counts:
+        machines = LockstepMachines(count)
+        machines.load_rom(rom_path)
+        start = time.perf_counter()
+        machines.run_cycles(steps)
+        elapsed = time.perf_counter() - start
+        results.append((count, count * steps / elapsed))
+    return results
+
+
+# Benchmark a ROM: python3 vector.py rom.ch8
+if __name__ == "__main__":
+    for count, instructions_per_second in benchmark(sys.argv[1]):
+        print(f"{count:6d} machines: {instructions_per_second:14,.0f} instructions/s")